@@ -1,5 +1,8 @@
 import streamlit as st
-from openpyxl import load_workbook
+from workbook_cache import get_workbook, cache_stats
+from formula_mapper import find_dependencies
+from named_index import NamedRangeIndex
+from named_coverage import coverage_report, formula_references, region_rows
 from openpyxl.utils import column_index_from_string, get_column_letter
 from io import BytesIO
 import re
@@ -43,12 +46,14 @@ if uploaded_files:
     all_named_ref_info = {}
     file_display_names = {}
     named_ref_formulas = {}
+    named_index = NamedRangeIndex()
+    cell_references = []
 
     for uploaded_file in uploaded_files:
         display_name = uploaded_file.name
         file_display_names[display_name] = uploaded_file
         st.header(f"\U0001F4C4 File: {display_name}")
-        wb = load_workbook(BytesIO(uploaded_file.read()), data_only=False)
+        wb = get_workbook(uploaded_file)
 
         for name in wb.defined_names:
             dn = wb.defined_names[name]
@@ -72,6 +77,10 @@ if uploaded_files:
                             all_named_cell_map[(display_name, sheet_name, r, c)] = (name, row_offset, col_offset)
                             coord_set.add((r, c))
                     all_named_ref_info[name] = (display_name, sheet_name, coord_set, min_row, min_col)
+                    named_index.add(
+                        display_name, sheet_name, name, min_row, min_col,
+                        max(r for r, _ in coord_set), max(c for _, c in coord_set)
+                    )
                 except:
                     continue
 
@@ -174,8 +183,7 @@ if uploaded_files:
         formulas_for_graph = []
 
         try:
-            file_bytes = file_display_names[file_name]
-            wb = load_workbook(BytesIO(file_bytes.getvalue()), data_only=False)
+            wb = get_workbook(file_display_names[file_name])
             ws = wb[sheet_name]
             min_col_letter = get_column_letter(min([c for (_, c) in coord_set]))
             max_col_letter = get_column_letter(max([c for (_, c) in coord_set]))
@@ -202,6 +210,9 @@ if uploaded_files:
                         if formula:
                             remapped = remap_formula(formula, file_name, sheet_name)
                             formulas_for_graph.append(remapped)
+                            cell_references.extend(
+                                (*reference, name) for reference in formula_references(formula, file_name, sheet_name)
+                            )
                         elif cell.value is not None:
                             formula = f"[value] {str(cell.value)}"
                             remapped = formula
@@ -228,27 +239,24 @@ if uploaded_files:
             st.code("\n".join(snippet), language="text")
             if limit is not None and len(entries) > limit:
                 st.write(f"...and {len(entries) - limit} more lines hidden")
+
+    st.caption(f"🗄️ Workbook cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
                 
     # —– Missing direct cell references (not in any named range) —–
     with st.expander("⚠️ Missing Direct Cell References", expanded=True):
         st.markdown("#### 🔍 Check for A1-style cell references not covered by any named range")
 
-        raw_ref_re = re.compile(r"\b([A-Z]{1,3}[0-9]{1,7})\b")
-        missing_refs = defaultdict(set)
-
-        for nm, formulas in named_ref_formulas.items():
-            for f in formulas:
-                for ref in raw_ref_re.findall(f):
-                    if re.search(rf"\[{nm}\]\[\d+\]\[\d+\]", f):
-                        continue
-                    missing_refs[nm].add(ref)
-
-        if missing_refs:
-            for nm, refs in missing_refs.items():
-                st.warning(
-                    f"In **{nm}**, these direct cell refs weren’t wrapped by a named range: "
-                    f"{', '.join(sorted(refs))}"
+        coverage = coverage_report(cell_references, named_index)
+
+        if any(workbook["uncovered_references"] for workbook in coverage.values()):
+            for workbook_name, workbook in coverage.items():
+                st.markdown(
+                    f"**{workbook_name}**: {workbook['coverage']:.1%} of {workbook['referenced_cells']:,} referenced cells "
+                    f"covered by named ranges · {workbook['uncovered_references']:,} of {workbook['references']:,} references uncovered"
                 )
+                rows = region_rows(workbook)
+                if rows:
+                    st.dataframe(pd.DataFrame(rows), use_container_width=True)
         else:
             st.success("✅ No missing direct cell references found.")
     
@@ -261,12 +269,7 @@ if uploaded_files:
     for name, (file, *_rest) in all_named_ref_info.items():
         grouped[file].append(name)
 
-    dependencies = defaultdict(set)
-    for target, formulas in named_ref_formulas.items():
-        joined = " ".join(formulas)
-        for source in named_ref_formulas:
-            if source != target and re.search(rf"\b{re.escape(source)}\b", joined):
-                dependencies[target].add(source)
+    dependencies = find_dependencies(named_ref_formulas)
 
     for i, (file_name, nodes) in enumerate(grouped.items()):
         with dot.subgraph(name=f"cluster_{i}") as c:
@@ -287,10 +290,17 @@ if uploaded_files:
     generate_json = st.button("🧾 Generate")
 
     if generate_json:
-        from openai import OpenAI
         import json
+        from llm_engine import call_chat_model, configure_backend, get_backend
+
+        if get_backend().name == "openai":
+            configure_backend(st.secrets["OPENAI_API_KEY"])
+
+        def ask_llm(system_msg, prompt, model="gpt-4o"):
+            # Raises LLMError on failure; callers leave the text blank and note it in `failed`
+            return call_chat_model(system_msg=system_msg, user_prompt=prompt, model=model)
 
-        client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+        failed = []
 
         summaries = {}
 
@@ -323,15 +333,7 @@ if uploaded_files:
     """
 
             try:
-                response = client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": "You summarize spreadsheet formulas into structured JSON."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.3
-                )
-                content = response.choices[0].message.content
+                content = ask_llm("You summarize spreadsheet formulas into structured JSON.", prompt, model="gpt-4")
                 parsed = json.loads(content)
                 
                 # Get file_name, sheet_name, coord_set for this named range
@@ -420,19 +422,11 @@ if uploaded_files:
         Use actuarial language. Do not say “likely”, “possibly”, or “may”. Be direct and factual.
         """
 
-            purpose_response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You write purpose sections for actuarial models."},
-                    {"role": "user", "content": purpose_prompt}
-                ],
-                temperature=0.3
-            )
-
-            model_purpose = purpose_response.choices[0].message.content.strip()
+            model_purpose = ask_llm("You write purpose sections for actuarial models.", purpose_prompt)
 
         except Exception as e:
-            model_purpose = f"Error generating purpose: {e}"
+            model_purpose = ""
+            failed.append(f"Purpose: {e}")
 
         
         # input data
@@ -514,17 +508,10 @@ if uploaded_files:
 """
 
             try:
-                response = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {"role": "system", "content": "You provide concise descriptions of actuarial inputs."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.3
-                )
-                row["Info"] = response.choices[0].message.content.strip()
+                row["Info"] = ask_llm("You provide concise descriptions of actuarial inputs.", prompt)
             except Exception as e:
-                row["Info"] = f"Error: {e}"
+                row["Info"] = ""
+                failed.append(f"Inputs – {row['Name']}: {e}")
         inputs_df = pd.DataFrame(inputs_data)
 
         # --- Output data ---
@@ -569,17 +556,10 @@ if uploaded_files:
         Respond with **one precise sentence**, or two if the second adds useful technical context."""
 
             try:
-                response = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {"role": "system", "content": "You describe actuarial spreadsheet outputs."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.3
-                )
-                row["Description"] = response.choices[0].message.content.strip()
+                row["Description"] = ask_llm("You describe actuarial spreadsheet outputs.", prompt)
             except Exception as e:
-                row["Description"] = f"Error: {e}"
+                row["Description"] = ""
+                failed.append(f"Outputs – {row['Name']}: {e}")
 
         outputs_df = pd.DataFrame(outputs_data)
 
@@ -633,17 +613,10 @@ if uploaded_files:
         """
 
             try:
-                response = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {"role": "system", "content": "You describe logic steps in actuarial models clearly."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.3
-                )
-                explanation = response.choices[0].message.content.strip()
+                explanation = ask_llm("You describe logic steps in actuarial models clearly.", prompt)
             except Exception as e:
-                explanation = f"Error generating description: {e}"
+                explanation = ""
+                failed.append(f"Logic – {name}: {e}")
 
             logic_steps.append({
                 "Step": step_number,
@@ -698,17 +671,10 @@ if uploaded_files:
         """
 
             try:
-                response = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {"role": "system", "content": "You describe spreadsheet checks in actuarial models."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.3
-                )
-                description = response.choices[0].message.content.strip()
+                description = ask_llm("You describe spreadsheet checks in actuarial models.", prompt)
             except Exception as e:
-                description = f"Error: {e}"
+                description = ""
+                failed.append(f"Checks – {name}: {e}")
 
             check_data.append({
                 "Check No.": check_num,
@@ -748,18 +714,15 @@ if uploaded_files:
         Avoid vague phrases like “it might be assumed” or “possibly”. Be direct and professional.
         """
 
-            assumptions_response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You describe assumptions and limitations in actuarial spreadsheet models."},
-                    {"role": "user", "content": assumptions_prompt}
-                ],
-                temperature=0.3
-            )
-            assumptions_text = assumptions_response.choices[0].message.content.strip()
+            assumptions_text = ask_llm("You describe assumptions and limitations in actuarial spreadsheet models.", assumptions_prompt)
 
         except Exception as e:
-            assumptions_text = f"Error generating assumptions and limitations: {e}"
+            assumptions_text = ""
+            failed.append(f"Assumptions: {e}")
+
+        # Failed sections are left blank in the tables and the Word document and listed once here
+        if failed:
+            st.warning("⚠️ Some sections could not be generated and were left blank:\n\n" + "\n".join(f"- {line}" for line in failed))
         
         with st.expander("📄 Spreadsheet Document", expanded=False):
             st.title("📄 Model Documentation")
@@ -1,10 +1,9 @@
 import streamlit as st
-from openpyxl import load_workbook
 from openpyxl.utils import column_index_from_string, get_column_letter
-from io import BytesIO
+from openpyxl.utils.cell import coordinate_from_string
 import re
 import os
-from collections import defaultdict
+import time
 import graphviz
 from docx import Document
 import pandas as pd
@@ -35,66 +34,36 @@ with st.expander("🔧 Manual Mapping for External References", expanded=False):
             external_refs[ref_key] = workbook_name
 
 uploaded_files = st.file_uploader("\U0001F4C2 Upload Excel files", type=["xlsx"], accept_multiple_files=True)
+ingestion_mode = st.radio(
+    "⚙️ Ingestion mode",
+    ["full", "streaming", "native"],
+    horizontal=True,
+    help="full: openpyxl workbook model · streaming: read-only, named range cells only · native: direct OOXML parse with shared formula expansion"
+)
+
+from file_handlers import DEFAULT_WORKERS
+parse_workers = st.number_input("🧵 Parallel parse workers", min_value=1, max_value=32, value=DEFAULT_WORKERS)
 
 if uploaded_files:  
     from file_handlers import handle_uploaded_files
-    data = handle_uploaded_files(uploaded_files)
-    all_named_cell_map = data["named_cell_map"]
+    data = handle_uploaded_files(uploaded_files, mode=ingestion_mode, workers=int(parse_workers))
+    for failed_file, error in data["file_errors"].items():
+        st.error(f"❌ Could not parse {failed_file}: {error}")
     all_named_ref_info = data["named_ref_info"]
     file_display_names = data["file_display_names"]
 
-    from formula_mapper import remap_formula
-    
-    named_ref_formulas = {}  # initialize the dictionary
-    for (name, (file_name, sheet_name, coord_set, min_row, min_col)) in all_named_ref_info.items():
-        entries = []
-        formulas_for_graph = []
-
-        try:
-            file_bytes = file_display_names[file_name]
-            wb = load_workbook(BytesIO(file_bytes.getvalue()), data_only=False)
-            ws = wb[sheet_name]
-            min_col_letter = get_column_letter(min([c for (_, c) in coord_set]))
-            max_col_letter = get_column_letter(max([c for (_, c) in coord_set]))
-            min_row_num = min([r for (r, _) in coord_set])
-            max_row_num = max([r for (r, _) in coord_set])
-            ref_range = f"{min_col_letter}{min_row_num}:{max_col_letter}{max_row_num}"
-            cell_range = ws[ref_range] if ":" in ref_range else [[ws[ref_range]]]
-
-            for row in cell_range:
-                for cell in row:
-                    row_offset = cell.row - min_row + 1
-                    col_offset = cell.column - min_col + 1
-                    label = f"{name}[{row_offset}][{col_offset}]"
-
-                    try:
-                        formula = None
-                        if isinstance(cell.value, str) and cell.value.startswith("="):
-                            formula = cell.value.strip()
-                        elif hasattr(cell, 'value') and hasattr(cell.value, 'text'):
-                            formula = str(cell.value.text).strip()
-                        elif hasattr(cell, 'value'):
-                            formula = str(cell.value)
-
-                        if formula:
-                            remapped = remap_formula(formula, file_name, sheet_name, all_named_cell_map, external_refs)
-                            formulas_for_graph.append(remapped)
-                        elif cell.value is not None:
-                            formula = f"[value] {str(cell.value)}"
-                            remapped = formula
-                        else:
-                            formula = "(empty)"
-                            remapped = formula
-                    except Exception as e:
-                        formula = f"[error reading cell: {e}]"
-                        remapped = formula
-
-                    entries.append(f"{label} = {formula}\n → {remapped}")
-        except Exception as e:
-            entries.append(f"❌ Error accessing {name} in {sheet_name}: {e}")
+    from formula_mapper import remap_named_ranges, find_dependencies, remap_cache_stats, remap_cache_hit_rate
+    from disk_cache import disk_cache_stats
+
+    remap_results = remap_named_ranges(data, external_refs)
 
+    named_ref_formulas = {}  # initialize the dictionary
+    for (name, (file_name, sheet_name, min_row, min_col, max_row, max_col)) in all_named_ref_info.items():
+        result = remap_results[name]
+        entries = result["entries"]
         
-        named_ref_formulas[name] = formulas_for_graph
+        # One remapped formula per distinct relative (R1C1) pattern
+        named_ref_formulas[name] = result["formulas"]
         
         limit = 50
         snippet = entries if limit is None else entries[:limit]
@@ -104,60 +73,107 @@ if uploaded_files:
             expanded=st.session_state.expanded_all
         ):
             st.code("\n".join(snippet), language="text")
-            if limit is not None and len(entries) > limit:
-                st.write(f"...and {len(entries) - limit} more lines hidden")
+            if limit is not None and result["cell_count"] > limit:
+                st.write(f"...and {result['cell_count'] - limit} more lines hidden")
+            st.caption(f"{result['cell_count']} cells in {len(result['classes'])} formula classes")
+
+    st.caption(
+        f"🗄️ Disk cache: {disk_cache_stats['hits']} hits / {disk_cache_stats['misses']} misses · "
+        f"Remap cache: {remap_cache_hit_rate():.0%} hit rate ({remap_cache_stats['hits']} hits / {remap_cache_stats['misses']} misses)"
+    )
                 
     # —– Missing direct cell references (not in any named range) —–
     with st.expander("⚠️ Missing Direct Cell References", expanded=True):
         st.markdown("#### 🔍 Check for A1-style cell references not covered by any named range")
 
-        raw_ref_re = re.compile(r"\b([A-Z]{1,3}[0-9]{1,7})\b")
-        missing_refs = defaultdict(set)
-
-        for nm, formulas in named_ref_formulas.items():
-            for f in formulas:
-                for ref in raw_ref_re.findall(f):
-                    if re.search(rf"\[{nm}\]\[\d+\]\[\d+\]", f):
-                        continue
-                    missing_refs[nm].add(ref)
-
-        if missing_refs:
-            for nm, refs in missing_refs.items():
-                st.warning(
-                    f"In **{nm}**, these direct cell refs weren’t wrapped by a named range: "
-                    f"{', '.join(sorted(refs))}"
+        # References come from the formula classes, each widened over its copies, and are
+        # checked against the named range rectangles; uncovered parts are merged per sheet
+        from named_coverage import class_references, coverage_report, region_rows
+
+        references = (
+            (*reference, name)
+            for name, result in remap_results.items()
+            for formula_class in result["classes"]
+            for reference in class_references(formula_class, *all_named_ref_info[name][:2])
+        )
+        coverage = coverage_report(references, data["named_index"])
+
+        if any(workbook["uncovered_references"] for workbook in coverage.values()):
+            for workbook_name, workbook in coverage.items():
+                st.markdown(
+                    f"**{workbook_name}**: {workbook['coverage']:.1%} of {workbook['referenced_cells']:,} referenced cells "
+                    f"covered by named ranges · {workbook['uncovered_references']:,} of {workbook['references']:,} references uncovered"
                 )
+                rows = region_rows(workbook)
+                if rows:
+                    st.dataframe(pd.DataFrame(rows), use_container_width=True)
         else:
             st.success("✅ No missing direct cell references found.")
     
     # Dependency Graph
     st.subheader("🔗 Dependency Graph")
-    dot = graphviz.Digraph()
-    dot.attr(compound='true', rankdir='LR')
-
-    grouped = defaultdict(list)
-    for name, (file, *_rest) in all_named_ref_info.items():
-        grouped[file].append(name)
-
-    dependencies = defaultdict(set)
-    for target, formulas in named_ref_formulas.items():
-        joined = " ".join(formulas)
-        for source in named_ref_formulas:
-            if source != target and re.search(rf"\b{re.escape(source)}\b", joined):
-                dependencies[target].add(source)
-
-    for i, (file_name, nodes) in enumerate(grouped.items()):
-        with dot.subgraph(name=f"cluster_{i}") as c:
-            c.attr(label=file_name)
-            c.attr(style='filled', color='lightgrey')
-            for node in nodes:
-                c.node(node)
-
-    for target, sources in dependencies.items():
-        for source in sources:
-            dot.edge(source, target)
+    dependencies = find_dependencies({name: remap_results[name]["swept"] for name in named_ref_formulas})
+
+    from graph_view import GROUPINGS, MAX_EXPANDED_NAMES, build_view, group_names, render_svg
+
+    view_cols = st.columns(3)
+    grouping = view_cols[0].radio("Group by", GROUPINGS, horizontal=True, key="graph_grouping")
+    focus = view_cols[1].selectbox("Focus on", ["(all)"] + sorted(all_named_ref_info), key="graph_focus")
+    hops = view_cols[2].slider("Hops around focus", 1, 5, 1, key="graph_hops")
+    group_labels = sorted(set(group_names(all_named_ref_info, dependencies, grouping).values()))
+    expanded = st.multiselect(
+        "Expanded groups",
+        group_labels,
+        default=group_labels if len(all_named_ref_info) <= MAX_EXPANDED_NAMES else [],
+        key=f"graph_expanded_{grouping}"
+    )
 
-    st.graphviz_chart(dot)
+    dot = build_view(
+        all_named_ref_info,
+        dependencies,
+        grouping=grouping,
+        expanded=set(expanded),
+        focus=None if focus == "(all)" else focus,
+        hops=hops
+    )
+    try:
+        st.markdown(render_svg(dot), unsafe_allow_html=True)
+    except (graphviz.ExecutableNotFound, graphviz.CalledProcessError):
+        st.graphviz_chart(dot)
+
+    with st.expander("🧮 Cell-level calculation chain", expanded=False):
+        if st.checkbox("Build cell-level dependency graph", key="build_cell_graph"):
+            from cell_graph import build_cell_graph, named_range_cells
+
+            cell_graph = build_cell_graph(named_range_cells(data), external_refs)
+            order, blocked = cell_graph.topological_order()
+            circular = cell_graph.circular_references()
+            depth, chain = cell_graph.longest_chain()
+            st.caption(
+                f"{cell_graph.formula_count} formula cells · {len(cell_graph)} nodes · "
+                f"{cell_graph.edge_count} edges · longest chain {depth}"
+            )
+            if circular:
+                for members in circular:
+                    st.warning("🔁 Circular reference: " + " → ".join(cell_graph.label(v) for v in members[:20]))
+            else:
+                st.success("✅ No circular references found.")
+            st.code(" → ".join(cell_graph.label(v) for v in chain), language="text")
+
+            file_choice = st.selectbox("File", list(file_display_names), key="cell_graph_file")
+            sheet_choice = st.text_input("Sheet", key="cell_graph_sheet")
+            address = st.text_input("Cell (e.g. B12)", key="cell_graph_cell")
+            if sheet_choice and address:
+                try:
+                    column, row = coordinate_from_string(address.strip().upper())
+                    node = cell_graph.node_id((file_choice, sheet_choice, row, column_index_from_string(column)))
+                except ValueError:
+                    node = None
+                if node is None:
+                    st.info("That cell is not part of the extracted formulas.")
+                else:
+                    st.write("**Precedents:** " + ", ".join(sorted(cell_graph.label(v) for v in cell_graph.all_precedents(node))))
+                    st.write("**Dependents:** " + ", ".join(sorted(cell_graph.label(v) for v in cell_graph.all_dependents(node))))
 
 # ---- Imports for AI-Generated Response ----
 
@@ -174,6 +190,8 @@ if uploaded_files:
     
     from prompt import (
             build_json_summary_prompt,
+            build_batch_summary_prompt,
+            build_batch_section,
             build_purpose_prompt,
             build_input_prompt,
             build_output_prompt,
@@ -182,30 +200,124 @@ if uploaded_files:
             build_assumptions_prompt
         )
         
-    from llm_engine import call_chat_model
+    from llm_engine import (
+        call_chat_models, stream_chat_model, rate_limiter, retry_settings, circuit_breaker,
+        estimate_tokens, llm_call_stats, LLMError, DEFAULT_CONCURRENCY
+    )
+    from summary_batches import BATCH_TOKEN_BUDGET, pack_batches, split_batch_response
+    from prompt_compactor import PROMPT_FORMULA_TOKENS, tokens_saved
+    from response_cache import response_cache_stats
+    from pipeline_scheduler import StageScheduler
     
 # --- JSON Summary Generation Section ---
     
     st.subheader("🧠 Generate JSON and Documentation")
 
+    llm_concurrency = st.number_input("⚡ Parallel LLM calls", min_value=1, max_value=64, value=DEFAULT_CONCURRENCY)
+    force_refresh = st.checkbox("♻️ Force refresh (ignore cached LLM responses)", value=False)
+    batch_cols = st.columns(2)
+    batch_summaries = batch_cols[0].checkbox("📦 Batch small named ranges into shared requests", value=False)
+    batch_token_budget = batch_cols[1].number_input("Batch prompt token budget", min_value=500, max_value=100000, value=BATCH_TOKEN_BUDGET, step=500)
+    prompt_token_budget = st.number_input("Formula tokens per named range in prompts", min_value=100, max_value=20000, value=PROMPT_FORMULA_TOKENS, step=100)
+    retry_cols = st.columns(2)
+    # Passed with each call, so one session's settings never change another's
+    llm_timeout = retry_cols[0].number_input("⏳ LLM call timeout (s)", min_value=5.0, max_value=600.0, value=retry_settings["timeout"], step=5.0)
+    hedge_after = retry_cols[1].number_input("Hedge slow calls after (s, 0 = off)", min_value=0.0, max_value=600.0, value=retry_settings["hedge_after"], step=1.0)
     generate_json = st.button("🧾 Generate")
+    st.caption(
+        f"💾 LLM response cache: {response_cache_stats['hits']} hits / {response_cache_stats['misses']} misses · "
+        f"{response_cache_stats['evictions']} evicted"
+    )
+    st.caption(
+        f"🔁 LLM calls: {llm_call_stats['requests']} requests · {llm_call_stats['retries']} retries · "
+        f"{llm_call_stats['hedges']} hedged ({llm_call_stats['hedge_wins']} won) · "
+        f"{llm_call_stats['failures']} failed · circuit {circuit_breaker.state}"
+    )
 
     if generate_json:
         
         summaries = {}
         
-        for name, formulas in named_ref_formulas.items():
-            if not formulas:
-                continue
+        # All JSON summaries are requested up front and run concurrently; responses come back in name order
+        summary_names = [name for name, formulas in named_ref_formulas.items() if formulas]
+        system_msg = "You summarize spreadsheet formulas into structured JSON."
 
-            try:
-                JSON_prompt = build_json_summary_prompt(name, formulas)
+        # Full vs compacted formula tokens per range, for this run only
+        compaction = {}
 
-                response = call_chat_model(
-                    system_msg="You summarize spreadsheet formulas into structured JSON.",
-                    user_prompt=JSON_prompt
+        def summary_prompt(name):
+            return build_json_summary_prompt(
+                name, named_ref_formulas[name], remap_results[name]["boundary"], budget=int(prompt_token_budget),
+                report=compaction
+            )
+
+        def single_summary_calls(names):
+            return [
+                {"system_msg": system_msg, "user_prompt": summary_prompt(name)}
+                for name in names
+            ]
+
+        responses = {}
+        if batch_summaries:
+            # Small ranges share a request; whatever a batch answer misses is retried on its own.
+            # Each range is sized by its own section; the shared instructions are paid once per batch.
+            overhead = estimate_tokens(build_batch_summary_prompt({}))
+            batches = [
+                batch for batch in pack_batches(
+                    {
+                        name: estimate_tokens(build_batch_section(
+                            name, named_ref_formulas[name], remap_results[name]["boundary"], budget=int(prompt_token_budget)
+                        ))
+                        for name in summary_names
+                    },
+                    budget=max(int(batch_token_budget) - overhead, 1)
                 )
-                
+                if len(batch) > 1
+            ]
+            batch_responses = call_chat_models(
+                [
+                    {
+                        "system_msg": system_msg,
+                        "user_prompt": build_batch_summary_prompt(
+                            {name: named_ref_formulas[name] for name in batch},
+                            {name: remap_results[name]["boundary"] for name in batch},
+                            budget=int(prompt_token_budget),
+                            report=compaction
+                        )
+                    }
+                    for batch in batches
+                ],
+                concurrency=int(llm_concurrency),
+                refresh=force_refresh,
+                timeout=llm_timeout,
+                hedge_after=hedge_after
+            )
+            for batch, response in zip(batches, batch_responses):
+                if not isinstance(response, LLMError):
+                    responses.update(split_batch_response(response, batch))
+
+        remaining = [name for name in summary_names if name not in responses]
+        responses.update(zip(remaining, call_chat_models(
+            single_summary_calls(remaining), concurrency=int(llm_concurrency), refresh=force_refresh,
+            timeout=llm_timeout, hedge_after=hedge_after
+        )))
+        if batch_summaries:
+            st.caption(
+                f"📦 {len(summary_names) - len(remaining)} named ranges summarized in {len(batches)} batched requests · "
+                f"{len(remaining)} sent individually"
+            )
+        summary_responses = [responses[name] for name in summary_names]
+        tokens_before, tokens_after = tokens_saved(compaction)
+        st.caption(
+            f"✂️ Formula samples: {tokens_after:,} prompt tokens instead of {tokens_before:,} "
+            f"({tokens_before - tokens_after:,} saved)"
+        )
+
+        for name, response in zip(summary_names, summary_responses):
+            if isinstance(response, LLMError):
+                summaries[name] = {"named_range": name, "error": response.as_dict()}
+                continue
+            try:
                 if response.startswith("```"):
                     import re
                     response = re.sub(r"^```(json)?", "", response)
@@ -214,12 +326,10 @@ if uploaded_files:
                 parsed = json.loads(response)
 
                 # (Continue adding file_name, sheet_name, dependencies, etc.)
-                file_name, sheet_name, coord_set, *_ = all_named_ref_info[name]
+                file_name, sheet_name, min_row_num, min_col, max_row_num, max_col = all_named_ref_info[name]
 
-                min_col_letter = get_column_letter(min([c for (_, c) in coord_set]))
-                max_col_letter = get_column_letter(max([c for (_, c) in coord_set]))
-                min_row_num = min([r for (r, _) in coord_set])
-                max_row_num = max([r for (r, _) in coord_set])
+                min_col_letter = get_column_letter(min_col)
+                max_col_letter = get_column_letter(max_col)
                 excel_range = f"{min_col_letter}{min_row_num}:{max_col_letter}{max_row_num}"
 
                 parsed.update({
@@ -233,7 +343,7 @@ if uploaded_files:
                 summaries[name] = parsed
 
             except Exception as e:
-                summaries[name] = {"named_range": name, "error": str(e)}
+                summaries[name] = {"named_range": name, "error": {"kind": "parse", "message": str(e)}}
 
         with st.expander("📦 View JSON Output", expanded=False):
             st.json(summaries)
@@ -241,15 +351,54 @@ if uploaded_files:
         #Import hints
         from hint import generate_individual_hints
         hint_map = generate_individual_hints(summaries)
-        
-        # --- Generate high-level Purpose description ---
-        purpose_prompt = build_purpose_prompt(summaries, purpose_example)
 
-        model_purpose = call_chat_model(
-            system_msg="You write purpose sections for actuarial models.",
-            user_prompt=purpose_prompt
-        )
-      
+        # Every section depends only on the summaries, so the scheduler runs all their rows
+        # side by side; each row streams into its own placeholder, so a piece redraws one row
+        st.subheader("✍️ Generated documentation")
+        live = {section: st.container() for section in ("Purpose", "Inputs", "Outputs", "Logic", "Checks", "Assumptions")}
+        row_slots = {section: [] for section in live}
+        live_rows = {section: {} for section in live}
+        row_labels = {section: {} for section in live}
+        # A streaming row is redrawn at most this often (seconds); finished rows always are
+        render_interval = float(os.getenv("STREAM_RENDER_INTERVAL", 0.1))
+        last_render = {}
+
+        def render_row(section, index):
+            text, done = live_rows[section][index]
+            label = row_labels[section].get(index)
+            prefix = f"**{label}**: " if label else ""
+            if isinstance(text, Exception):
+                text = f"⚠️ not generated ({text})"
+            row_slots[section][index].markdown(f"{prefix}{text}" + ("" if done else "▌"))
+
+        def on_event(kind, section, index, value):
+            if kind == "piece":
+                text, _ = live_rows[section].get(index, ("", False))
+                live_rows[section][index] = (text + value, False)
+                now = time.perf_counter()
+                if now - last_render.get((section, index), 0.0) < render_interval:
+                    return
+                last_render[(section, index)] = now
+            elif kind == "row":
+                live_rows[section][index] = (value, True)
+            else:
+                return
+            render_row(section, index)
+
+        def llm_task(system_msg, prompt_of):
+            # A scheduler row: stream one call, forwarding pieces to the UI thread. A failed
+            # call or prompt raises, and the scheduler records the error as the row's value
+            def run(row, results, emit):
+                text = ""
+                for piece in stream_chat_model(
+                    system_msg=system_msg, user_prompt=prompt_of(row), limiter=rate_limiter, refresh=force_refresh,
+                    timeout=llm_timeout
+                ):
+                    text += piece
+                    emit(piece)
+                return text.strip()
+            return run
+
         # input data
         input_summaries = {k: v for k, v in summaries.items() if k.startswith("i_")}
         inputs_data = []
@@ -296,23 +445,6 @@ if uploaded_files:
                 "Source": source,
                 "Info": ""  # To be filled by GPT
             })
-            
-        # GPT to populate Info field
-        for row in inputs_data:
-            input_name = row["Name"]
-            summary_json = input_summaries[input_name]
-            json_summary = summary_json.get("summary", "")
-            general_formula = summary_json.get("general_formula", "")
-            sheet = summary_json.get("sheet_name", "")
-            excel_range = summary_json.get("excel_range", "")
-
-            input_hint = hint_map.get(input_name, "")
-            input_prompt = build_input_prompt(input_name, summary_json, input_hint,input_example)
-            row["Info"] = call_chat_model(
-                system_msg="You provide concise descriptions of actuarial inputs.",
-                user_prompt=input_prompt
-            )
-        inputs_df = pd.DataFrame(inputs_data)
 
         # --- Output data ---
         output_summaries = {k: v for k, v in summaries.items() if k.startswith("o_")}
@@ -323,26 +455,6 @@ if uploaded_files:
                 "Name": name,
                 "Description": ""  # To be filled by GPT
             })
-        output_names = " ".join(output_summaries.keys()).lower()
-
-                   
-        # GPT to populate output descriptions
-        for row in outputs_data:
-            output_name = row["Name"]
-            summary_json = output_summaries[output_name]
-            json_summary = summary_json.get("summary", "")
-            general_formula = summary_json.get("general_formula", "")
-            sheet = summary_json.get("sheet_name", "")
-            excel_range = summary_json.get("excel_range", "")
-
-            output_hint = hint_map.get(output_name, "")
-            output_prompt = build_output_prompt(name, summary_json, output_hint,output_example)
-            row["Description"] = call_chat_model(
-                system_msg="You describe actuarial spreadsheet outputs.",
-                user_prompt=output_prompt
-            )
-            
-        outputs_df = pd.DataFrame(outputs_data)
 
         # --- Logic documentation based on _c1_, _c2_, etc. ---
         logic_summaries = {}
@@ -354,40 +466,14 @@ if uploaded_files:
             if match:
                 step_number = int(match.group(1))
                 logic_summaries[step_number] = name
+        logic_rows = [(step_number, logic_summaries[step_number]) for step_number in sorted(logic_summaries)]
 
-        logic_steps = []
-        for step_number in sorted(logic_summaries):
-            name = logic_summaries[step_number]
-            summary_json = summaries[name]
-            json_summary = summary_json.get("summary", "")
-            general_formula = summary_json.get("general_formula", "")
-            dependencies_list = summary_json.get("dependencies", [])
-            excel_range = summary_json.get("excel_range", "")
-            sheet = summary_json.get("sheet_name", "")
-
-            logic_hint = hint_map.get(name, "")
-            logic_prompt = build_logic_prompt(name, summary_json, step_number, logic_hint,logic_example)
-
-            system_msg = (
-                "You are writing actuarial documentation for a spreadsheet model. "
-                "You must describe logic steps using exactly 3 points: Purpose, Calculation Type, and Dependencies. "
-                "Use the headings '**1. Purpose:**', '**2. Calculation Type:**', and '**3. Dependencies:**' as bullets. "
-                "Avoid vague or generic statements."
-            )
-            explanation = call_chat_model(
-                system_msg=system_msg,
-                user_prompt=logic_prompt
-            )
-            
-            logic_steps.append({
-                "Step": step_number,
-                "Named Range": name,
-                "Description": explanation
-            })
-
-        # If no _cN_ logic blocks found, issue warning
-        if not logic_steps:
-            st.warning("⚠️ No logic components found using `_c1_`, `_c2_`, etc. naming convention. Please check that named ranges follow this format.")
+        logic_system_msg = (
+            "You are writing actuarial documentation for a spreadsheet model. "
+            "You must describe logic steps using exactly 3 points: Purpose, Calculation Type, and Dependencies. "
+            "Use the headings '**1. Purpose:**', '**2. Calculation Type:**', and '**3. Dependencies:**' as bullets. "
+            "Avoid vague or generic statements."
+        )
 
         # --- Checks and Validation ---
         check_pattern = re.compile(r"^_ch(\d+)_.*")  # matches _ch1_, _ch2_, etc.
@@ -399,52 +485,98 @@ if uploaded_files:
             if match:
                 check_num = int(match.group(1))
                 check_summaries[check_num] = name
+        check_rows = [(check_num, check_summaries[check_num]) for check_num in sorted(check_summaries)]
 
-        check_data = []
-        for check_num in sorted(check_summaries):
-            name = check_summaries[check_num]
-            summary_json = summaries[name]
-            json_summary = summary_json.get("summary", "")
-            general_formula = summary_json.get("general_formula", "")
-            sheet = summary_json.get("sheet_name", "")
-            excel_range = summary_json.get("excel_range", "")
-
-            # GPT prompt to describe what the check does
-            check_hint = hint_map.get(name, "")
-            check_prompt = build_check_prompt(name, summary_json, check_hint,check_example)
-
-            description = call_chat_model(
-                system_msg="You describe spreadsheet checks in actuarial models.",
-                user_prompt=check_prompt
-            )
-            
-            check_data.append({
-                "Check No.": check_num,
-                "Named Range": name,
-                "Description": description
-            })
+        # --- Assumptions and Limitations ---
+        assumptions_task = llm_task(
+            "You describe assumptions and limitations in actuarial spreadsheet models.",
+            lambda _: build_assumptions_prompt(summaries, assumption_example)
+        )
 
-        # Convert to DataFrame for Streamlit and Word doc
-        checks_df = pd.DataFrame(check_data)
+        row_labels["Inputs"] = {i: row["Name"] for i, row in enumerate(inputs_data)}
+        row_labels["Outputs"] = {i: row["Name"] for i, row in enumerate(outputs_data)}
+        row_labels["Logic"] = {i: f"Step {step} – {name}" for i, (step, name) in enumerate(logic_rows)}
+        row_labels["Checks"] = {i: name for i, (_, name) in enumerate(check_rows)}
+
+        row_counts = {
+            "Purpose": 1, "Inputs": len(inputs_data), "Outputs": len(outputs_data),
+            "Logic": len(logic_rows), "Checks": len(check_rows), "Assumptions": 1,
+        }
+        for section, count in row_counts.items():
+            live[section].markdown(f"#### {section}")
+            row_slots[section] = [live[section].empty() for _ in range(count)]
+
+        scheduler = StageScheduler(concurrency=int(llm_concurrency))
+        scheduler.add("Purpose", [None], llm_task(
+            "You write purpose sections for actuarial models.",
+            lambda _: build_purpose_prompt(summaries, purpose_example)
+        ))
+        scheduler.add("Inputs", inputs_data, llm_task(
+            "You provide concise descriptions of actuarial inputs.",
+            lambda row: build_input_prompt(row["Name"], input_summaries[row["Name"]], hint_map.get(row["Name"], ""), input_example)
+        ))
+        scheduler.add("Outputs", outputs_data, llm_task(
+            "You describe actuarial spreadsheet outputs.",
+            lambda row: build_output_prompt(row["Name"], output_summaries[row["Name"]], hint_map.get(row["Name"], ""), output_example)
+        ))
+        scheduler.add("Logic", logic_rows, llm_task(
+            logic_system_msg,
+            lambda row: build_logic_prompt(row[1], summaries[row[1]], row[0], hint_map.get(row[1], ""), logic_example)
+        ))
+        scheduler.add("Checks", check_rows, llm_task(
+            "You describe spreadsheet checks in actuarial models.",
+            lambda row: build_check_prompt(row[1], summaries[row[1]], hint_map.get(row[1], ""), check_example)
+        ))
+        scheduler.add("Assumptions", [None], assumptions_task)
+        stage_results = scheduler.run(on_event)
+
+        # Failed rows are left blank in the tables and the Word document and listed once here
+        failed = [
+            f"{section} – {row_labels[section].get(index) or section}: {value}"
+            for section, values in stage_results.items()
+            for index, value in enumerate(values)
+            if isinstance(value, Exception)
+        ]
+        if failed:
+            st.warning("⚠️ Some sections could not be generated and were left blank:\n\n" + "\n".join(f"- {line}" for line in failed))
+        stage_results = {
+            section: ["" if isinstance(value, Exception) else value for value in values]
+            for section, values in stage_results.items()
+        }
+
+        model_purpose = stage_results["Purpose"][0]
+        for row, info in zip(inputs_data, stage_results["Inputs"]):
+            row["Info"] = info
+        inputs_df = pd.DataFrame(inputs_data)
+        for row, description in zip(outputs_data, stage_results["Outputs"]):
+            row["Description"] = description
+        outputs_df = pd.DataFrame(outputs_data)
 
-        # --- Assumptions and Limitations ---
-        try:
-            all_summaries = "\n".join(
-                f"{k}: {v.get('summary', '')}" for k, v in summaries.items() if "summary" in v
-            )
-            all_formulas = "\n".join(
-                f"{k}: {v.get('general_formula', '')}" for k, v in summaries.items() if "general_formula" in v
-            )
+        logic_steps = [
+            {"Step": step_number, "Named Range": name, "Description": explanation}
+            for (step_number, name), explanation in zip(logic_rows, stage_results["Logic"])
+        ]
+        # If no _cN_ logic blocks found, issue warning
+        if not logic_steps:
+            st.warning("⚠️ No logic components found using `_c1_`, `_c2_`, etc. naming convention. Please check that named ranges follow this format.")
 
-            assumptions_prompt = build_assumptions_prompt(summaries, assumption_example)
+        check_data = [
+            {"Check No.": check_num, "Named Range": name, "Description": description}
+            for (check_num, name), description in zip(check_rows, stage_results["Checks"])
+        ]
+        # Convert to DataFrame for Streamlit and Word doc
+        checks_df = pd.DataFrame(check_data)
 
-            assumptions_text = call_chat_model(
-                system_msg="You describe assumptions and limitations in actuarial spreadsheet models.",
-                user_prompt=assumptions_prompt
-            )
+        assumptions_text = stage_results["Assumptions"][0]
 
-        except Exception as e:
-            assumptions_text = f"Error generating assumptions and limitations: {e}"
+        with st.expander("⏱️ Generation timings", expanded=False):
+            timing_df = pd.DataFrame(scheduler.timing_report())
+            st.dataframe(timing_df, use_container_width=True)
+            if not timing_df.empty:
+                st.caption(
+                    f"Finished in {timing_df['Finished (s)'].max():.1f}s against "
+                    f"{timing_df['Row time (s)'].sum():.1f}s of LLM time run back to back."
+                )
         
         
         with st.expander("📄 Spreadsheet Document", expanded=False):
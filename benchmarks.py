@@ -0,0 +1,304 @@
+# benchmarks.py
+# Run with: python benchmarks.py [name ...]
+import json
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+from io import BytesIO
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+from openpyxl.workbook.defined_name import DefinedName
+
+
+class BenchUpload(BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def build_workbook(n_names=50, rows=40, cols=12, wide_rows=200, wide_cols=200):
+    # One input block plus n_names calculation blocks stacked down a sheet,
+    # each block referencing the one above it, and an unnamed simulation sheet
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Calc"
+    wide = wb.create_sheet("Wide")
+    for r in range(1, wide_rows + 1):
+        for c in range(1, wide_cols + 1):
+            wide.cell(r, c, r + c / 1000)
+    for c in range(1, cols + 1):
+        for r in range(1, rows + 1):
+            ws.cell(r, c, r * c)
+    # Dates are stored as serial numbers in a date format, which every mode must read back as dates
+    ws.cell(1, 1, datetime(2020, 1, 2))
+    ws.cell(2, 1, timedelta(hours=30))
+    wb.defined_names["i_base"] = DefinedName("i_base", attr_text=f"Calc!$A$1:${get_column_letter(cols)}${rows}")
+
+    for n in range(1, n_names + 1):
+        top = n * rows + 1
+        for r in range(top, top + rows):
+            for c in range(1, cols + 1):
+                col = get_column_letter(c)
+                ws.cell(r, c, f"={col}{r - rows}*1.01+SUM($A{r - rows}:{col}{r - rows})")
+        ref = f"Calc!$A${top}:${get_column_letter(cols)}${top + rows - 1}"
+        wb.defined_names[f"_c{n}_block"] = DefinedName(f"_c{n}_block", attr_text=ref)
+
+    out = BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_extract():
+    from file_handlers import handle_uploaded_files, INGESTION_MODES
+    from workbook_cache import clear_workbook_cache
+
+    data = build_workbook()
+    print(f"extract: {len(data) / 1e6:.1f} MB workbook")
+    baseline = reference = None
+    for mode in INGESTION_MODES:
+        def run():
+            # Parsing is what's measured, so the persistent cache is neither read nor written
+            clear_workbook_cache()
+            return handle_uploaded_files([BenchUpload(data, "bench.xlsx")], mode=mode, use_disk_cache=False)
+        seconds, result = timed(run)
+        baseline = baseline or seconds
+        # Typed cell values, so a date read back as its serial number counts as a difference
+        reference = reference or result["named_ref_cells"]
+        same = result["named_ref_cells"] == reference
+        print(f"  {mode:<10} {seconds:7.3f}s  x{baseline / seconds:5.1f}  same as full={same}")
+
+
+def sample_formulas(n=20000):
+    shapes = [
+        "={col}{r}*1.01+SUM($A{r}:{col}{r})",
+        "=IF(Calc!{col}{r}>0,LOG10(Calc!{col}{r}),\"n/a {col}{r}\")",
+        "=VLOOKUP($A{r},'Base Rates'!$A$1:$Z$500,{c},FALSE)*i_base",
+        "=SUM({col}:{col})/COUNT(1:{r})+[1]Inputs!$B$2",
+    ]
+    formulas = []
+    for i in range(n):
+        c = i % 12 + 1
+        formulas.append(shapes[i % len(shapes)].format(col=get_column_letter(c), r=i % 500 + 2, c=c))
+    return formulas
+
+
+def bench_remap():
+    from formula_mapper import clear_remap_cache, remap_formula
+    from formula_tokenizer import tokenize
+    from named_index import NamedRangeIndex
+
+    index = NamedRangeIndex()
+    for n in range(1, 51):
+        index.add("bench.xlsx", "Calc", f"_c{n}_block", n * 40 + 1, 1, n * 40 + 40, 12)
+    index.add("bench.xlsx", "Base Rates", "i_rates", 1, 1, 500, 26)
+    formulas = sample_formulas()
+
+    seconds, _ = timed(lambda: [tokenize(f) for f in formulas])
+    print(f"tokenize: {len(formulas) / seconds:,.0f} formulas/s")
+    def remap_all():
+        return [remap_formula(f, "bench.xlsx", "Calc", index, {}) for f in formulas]
+
+    def remap_cold():
+        clear_remap_cache()
+        return remap_all()
+
+    seconds, _ = timed(remap_cold)
+    print(f"remap:    {len(formulas) / seconds:,.0f} formulas/s cold ({len(set(formulas)):,} distinct formulas)")
+    # The last cold run left every formula memoised
+    seconds, _ = timed(remap_all)
+    print(f"remap:    {len(formulas) / seconds:,.0f} formulas/s memoised")
+
+
+def regex_dependencies(formulas_by_name):
+    # The per-name regex scan the apps used before find_dependencies
+    import re
+    from collections import defaultdict
+
+    dependencies = defaultdict(set)
+    for target, formulas in formulas_by_name.items():
+        joined = " ".join(formulas)
+        for source in formulas_by_name:
+            if source != target and re.search(rf"\b{re.escape(source)}\b", joined):
+                dependencies[target].add(source)
+    return dependencies
+
+
+def bench_dependencies(sizes=(100, 1000, 10000), regex_limit=1000):
+    from formula_mapper import find_dependencies
+
+    for n in sizes:
+        formulas_by_name = {
+            f"_c{i}_block": [
+                f"=[bench.xlsx]_c{(i * 7) % n}_block[1:40][1:12]*1.01",
+                f"=SUM([bench.xlsx]_c{(i * 13) % n}_block[1][1:12])+i_base",
+            ]
+            for i in range(n)
+        }
+        seconds, fast = timed(lambda: find_dependencies(formulas_by_name))
+        line = f"dependencies {n:>6} names: one pass {seconds:8.3f}s"
+        if n <= regex_limit:
+            old_seconds, old = timed(lambda: regex_dependencies(formulas_by_name), repeat=1)
+            line += f"  regex {old_seconds:8.3f}s  x{old_seconds / seconds:6.0f}  same={dict(old) == dict(fast)}"
+        else:
+            line += "  regex skipped (quadratic)"
+        print(line)
+
+
+SUMMARY_SYSTEM_MSG = "You summarize spreadsheet formulas into structured JSON."
+
+
+def pipeline_names(n):
+    # Spread over the naming conventions appv2 builds its document sections from
+    patterns = ["i_a_rate{}", "o_result{}", "_c{}_step", "_ch{}_total"]
+    return [patterns[i % len(patterns)].format(i // len(patterns) + 1) for i in range(n)]
+
+
+def stub_responder(model, messages):
+    # Deterministic text shaped like real answers: JSON for summaries, a paragraph otherwise
+    prompt = messages[-1]["content"]
+    digest = sum(prompt.encode("utf-8")) % 9973
+    if messages[0]["content"] == SUMMARY_SYSTEM_MSG:
+        return json.dumps({"summary": f"Projects block {digest} forward one period.", "general_formula": "Result[i][j] = Input[i][j] * 1.01"})
+    return " ".join(f"word{(digest + i) % 97}" for i in range(60)) + "."
+
+
+def run_pipeline(names, concurrency, limiter):
+    # appv2's Generate pipeline without the UI: concurrent JSON summaries, then every
+    # document section as a scheduler stage of streamed calls. Returns (summaries, sections, scheduler).
+    from llm_engine import call_chat_models, stream_chat_model, LLMError
+    from pipeline_scheduler import StageScheduler
+    from prompt import (
+        build_json_summary_prompt, build_purpose_prompt, build_input_prompt, build_output_prompt,
+        build_logic_prompt, build_check_prompt, build_assumptions_prompt
+    )
+
+    formulas = {name: [f"=[bench.xlsx]{name}[1][1]*1.01", f"=SUM([bench.xlsx]{name}[1][1:12])"] for name in names}
+    responses = call_chat_models(
+        [{"system_msg": SUMMARY_SYSTEM_MSG, "user_prompt": build_json_summary_prompt(name, formulas[name])} for name in names],
+        concurrency=concurrency,
+        limiter=limiter,
+        hedge_after=0
+    )
+    summaries = {}
+    for name, response in zip(names, responses):
+        if isinstance(response, LLMError):
+            summaries[name] = {"named_range": name, "error": response.as_dict()}
+        else:
+            summaries[name] = dict(json.loads(response), named_range=name)
+
+    def streamed(system_msg, prompt_of):
+        # A failed call raises, and the scheduler keeps its LLMError as the row's value
+        def run(row, results, emit):
+            return "".join(stream_chat_model(system_msg, prompt_of(row), limiter=limiter)).strip()
+        return run
+
+    logic = sorted((int(m.group(1)), name) for name in names for m in [re.match(r"^_c(\d+)_", name)] if m)
+    checks = sorted((int(m.group(1)), name) for name in names for m in [re.match(r"^_ch(\d+)_", name)] if m)
+    scheduler = StageScheduler(concurrency=concurrency)
+    scheduler.add("Purpose", [None], streamed(
+        "You write purpose sections for actuarial models.", lambda _: build_purpose_prompt(summaries)))
+    scheduler.add("Inputs", [n for n in names if n.startswith("i_")], streamed(
+        "You provide concise descriptions of actuarial inputs.", lambda n: build_input_prompt(n, summaries[n])))
+    scheduler.add("Outputs", [n for n in names if n.startswith("o_")], streamed(
+        "You describe actuarial spreadsheet outputs.", lambda n: build_output_prompt(n, summaries[n])))
+    scheduler.add("Logic", logic, streamed(
+        "You are writing actuarial documentation for a spreadsheet model.",
+        lambda row: build_logic_prompt(row[1], summaries[row[1]], row[0])))
+    scheduler.add("Checks", checks, streamed(
+        "You describe spreadsheet checks in actuarial models.", lambda row: build_check_prompt(row[1], summaries[row[1]])))
+    scheduler.add("Assumptions", [None], streamed(
+        "You describe assumptions and limitations in actuarial spreadsheet models.",
+        lambda _: build_assumptions_prompt(summaries)))
+    sections = scheduler.run()
+    return summaries, sections, scheduler
+
+
+def bench_pipeline(n_names=24, latency=0.1, jitter=0.05, token_delay=0.002, error_rate=0.05, concurrency=(1, 8, 32)):
+    # End-to-end throughput against the local stub backend: no network, no spend, and the same
+    # latencies and injected errors on every run. The last run is recorded to a cassette and
+    # replayed, which must reproduce it exactly.
+    import os
+    import tempfile
+    import llm_engine
+    from llm_backends import CassetteBackend, StubBackend
+
+    def stub():
+        return StubBackend(
+            latency=latency, jitter=jitter, token_delay=token_delay, error_rate=error_rate,
+            error_status=503, responder=stub_responder
+        )
+
+    def describe(result):
+        # LLMError rows compare by their text
+        summaries, sections, _ = result
+        return json.dumps([summaries, {k: [str(v) for v in values] for k, values in sections.items()}], sort_keys=True)
+
+    names = pipeline_names(n_names)
+    # Rate limits high enough never to bind, backoff short enough not to dominate
+    limiter = llm_engine.RateLimiter(10 ** 6, 10 ** 9)
+    saved_cache, saved_retry = dict(llm_engine.cache_settings), dict(llm_engine.retry_settings)
+    saved_backend, saved_breaker = llm_engine.get_backend(), llm_engine.circuit_breaker
+    llm_engine.cache_settings["enabled"] = False
+    llm_engine.retry_settings.update(backoff_base=0.05, backoff_max=0.5)
+    print(
+        f"pipeline {n_names} names, stub latency {latency}s ±{jitter}s, "
+        f"{token_delay * 1000:.0f}ms per token, {error_rate:.0%} transient 503s"
+    )
+    try:
+        result = None
+        for workers in concurrency:
+            llm_engine.set_backend(stub())
+            llm_engine.circuit_breaker = llm_engine.CircuitBreaker()
+            before = dict(llm_engine.llm_call_stats)
+            start = time.perf_counter()
+            result = run_pipeline(names, workers, limiter)
+            seconds = time.perf_counter() - start
+            stats = {k: llm_engine.llm_call_stats[k] - before[k] for k in before}
+            print(
+                f"  concurrency {workers:>3}: {seconds:7.2f}s  {stats['requests']:>4} requests  "
+                f"{stats['requests'] / seconds:6.1f} req/s  {stats['retries']} retries  {stats['failures']} failed"
+            )
+        for row in result[2].timing_report():
+            print(f"    {row['Stage']:<12} {row['Rows']:>3} rows  wall {row['Wall (s)']:6.2f}s  row time {row['Row time (s)']:6.2f}s")
+
+        with tempfile.TemporaryDirectory() as folder:
+            cassette = os.path.join(folder, "pipeline.json")
+            llm_engine.set_backend(CassetteBackend(cassette, mode="record", inner=stub()))
+            llm_engine.circuit_breaker = llm_engine.CircuitBreaker()
+            recorded = run_pipeline(names, concurrency[-1], limiter)
+            llm_engine.set_backend(CassetteBackend(cassette, mode="replay"))
+            llm_engine.circuit_breaker = llm_engine.CircuitBreaker()
+            seconds, replayed = timed(lambda: run_pipeline(names, concurrency[-1], limiter))
+            print(
+                f"  replay of {len(llm_engine.get_backend())} recorded responses: {seconds:7.3f}s  "
+                f"same={describe(recorded) == describe(replayed)}"
+            )
+    finally:
+        llm_engine.set_backend(saved_backend)
+        llm_engine.circuit_breaker = saved_breaker
+        llm_engine.cache_settings.update(saved_cache)
+        llm_engine.retry_settings.update(saved_retry)
+
+
+BENCHMARKS = {
+    "extract": bench_extract,
+    "remap": bench_remap,
+    "dependencies": bench_dependencies,
+    "pipeline": bench_pipeline,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -0,0 +1,274 @@
+# cell_graph.py
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from formula_tokenizer import iter_refs, area_bounds
+from formula_mapper import cell_formula_text, range_address
+
+# Nodes are cells (file, sheet, row, col) or ranges (file, sheet, min_row, min_col, max_row, max_col).
+# An edge runs from a precedent to its dependent: referenced cell -> formula cell,
+# range -> formula cell, and every formula cell inside a range -> that range.
+# Ranges are never expanded into their cells, so SUM(A1:A100000) is one node.
+
+
+def _csr(count, sources, targets):
+    # Edge list -> (indptr, indices); the sort runs in C, which beats a Python counting pass
+    order = sorted(range(len(sources)), key=sources.__getitem__)
+    indices = array("q", map(targets.__getitem__, order))
+    indptr = array("q", [0]) * (count + 1)
+    for s in sources:
+        indptr[s + 1] += 1
+    for i in range(count):
+        indptr[i + 1] += indptr[i]
+    return indptr, indices
+
+
+class CellGraph:
+
+    def __init__(self, nodes, formula_count, sources, targets):
+        self.nodes = nodes
+        self.ids = {node: i for i, node in enumerate(nodes)}
+        # The first formula_count nodes are the formula cells
+        self.formula_count = formula_count
+        self.edge_count = len(sources)
+        self._out_ptr, self._out = _csr(len(nodes), sources, targets)
+        self._in_ptr, self._in = _csr(len(nodes), targets, sources)
+        self._components = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def node_id(self, node):
+        return self.ids.get(node)
+
+    def dependents(self, node_id):
+        return self._out[self._out_ptr[node_id]:self._out_ptr[node_id + 1]]
+
+    def precedents(self, node_id):
+        return self._in[self._in_ptr[node_id]:self._in_ptr[node_id + 1]]
+
+    def _reach(self, start, ptr, adj, max_depth=None):
+        seen = {start}
+        frontier = [start]
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            depth += 1
+            nxt = []
+            for v in frontier:
+                for w in adj[ptr[v]:ptr[v + 1]]:
+                    if w not in seen:
+                        seen.add(w)
+                        nxt.append(w)
+            frontier = nxt
+        seen.discard(start)
+        return seen
+
+    def all_precedents(self, node_id, max_depth=None):
+        return self._reach(node_id, self._in_ptr, self._in, max_depth)
+
+    def all_dependents(self, node_id, max_depth=None):
+        return self._reach(node_id, self._out_ptr, self._out, max_depth)
+
+    def topological_order(self):
+        # Kahn's algorithm; nodes on or behind a cycle are returned separately
+        count = len(self.nodes)
+        indegree = array("q", [0]) * count
+        for w in self._out:
+            indegree[w] += 1
+        ready = [v for v in range(count) if indegree[v] == 0]
+        order = []
+        while ready:
+            v = ready.pop()
+            order.append(v)
+            for w in self._out[self._out_ptr[v]:self._out_ptr[v + 1]]:
+                indegree[w] -= 1
+                if indegree[w] == 0:
+                    ready.append(w)
+        blocked = [v for v in range(count) if indegree[v] > 0]
+        return order, blocked
+
+    def components(self):
+        # Iterative Tarjan: (component id per node, components in reverse topological order)
+        if self._components is not None:
+            return self._components
+        count = len(self.nodes)
+        ptr, adj = self._out_ptr, self._out
+        index = array("q", [-1]) * count
+        low = array("q", [0]) * count
+        comp = array("q", [-1]) * count
+        on_stack = bytearray(count)
+        stack = []
+        components = []
+        counter = 0
+
+        for root in range(count):
+            if index[root] != -1:
+                continue
+            work = [(root, ptr[root])]
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            while work:
+                v, i = work[-1]
+                if i < ptr[v + 1]:
+                    work[-1] = (v, i + 1)
+                    w = adj[i]
+                    if index[w] == -1:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = 1
+                        work.append((w, ptr[w]))
+                    elif on_stack[w] and index[w] < low[v]:
+                        low[v] = index[w]
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if low[v] < low[parent]:
+                        low[parent] = low[v]
+                if low[v] == index[v]:
+                    members = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = 0
+                        comp[w] = len(components)
+                        members.append(w)
+                        if w == v:
+                            break
+                    components.append(members)
+
+        self._components = (comp, components)
+        return self._components
+
+    def circular_references(self):
+        comp, components = self.components()
+        cycles = []
+        for members in components:
+            if len(members) > 1:
+                cycles.append(members)
+            elif members[0] in self.dependents(members[0]):
+                cycles.append(members)
+        return cycles
+
+    def chain_depths(self):
+        # Longest precedent chain ending at each node, counting a circular group as one step
+        comp, components = self.components()
+        depth = array("q", [0]) * len(components)
+        # Tarjan emits components dependents-first, so walk them backwards
+        for c in range(len(components) - 1, -1, -1):
+            best = 0
+            for v in components[c]:
+                for u in self.precedents(v):
+                    cu = comp[u]
+                    if cu != c and depth[cu] > best:
+                        best = depth[cu]
+            depth[c] = best + 1
+        return array("q", (depth[comp[v]] for v in range(len(self.nodes))))
+
+    def longest_chain(self):
+        # (depth, node ids from the first precedent to the last dependent)
+        if not self.nodes:
+            return 0, []
+        depths = self.chain_depths()
+        end = max(range(len(depths)), key=depths.__getitem__)
+        comp, _ = self.components()
+        path = [end]
+        v = end
+        while True:
+            step = next((u for u in self.precedents(v) if comp[u] != comp[v] and depths[u] == depths[v] - 1), None)
+            if step is None:
+                break
+            path.append(step)
+            v = step
+        path.reverse()
+        return depths[end], path
+
+    def label(self, node_id):
+        node = self.nodes[node_id]
+        file_name, sheet_name = node[0], node[1]
+        if len(node) == 4:
+            return f"[{file_name}]{sheet_name}!{range_address(node[2], node[3], node[2], node[3])}"
+        return f"[{file_name}]{sheet_name}!{range_address(*node[2:])}"
+
+
+def build_cell_graph(formula_cells, external_refs=None):
+    # formula_cells: iterable of (file, sheet, row, col, formula_text); non-formulas are skipped
+    external_refs = external_refs or {}
+    ids = {}
+    cells = []
+    for f, s, r, c, text in formula_cells:
+        # Overlapping named ranges hand the same cell over more than once
+        if text.startswith("=") and (f, s, r, c) not in ids:
+            ids[(f, s, r, c)] = len(cells)
+            cells.append((f, s, r, c, text))
+    nodes = [(f, s, r, c) for f, s, r, c, _ in cells]
+    formula_count = len(nodes)
+    sources, targets = array("q"), array("q")
+
+    def node_for(key):
+        i = ids.get(key)
+        if i is None:
+            i = ids[key] = len(nodes)
+            nodes.append(key)
+        return i
+
+    bounds_of = {}
+    ranges = []
+    for target, (file_name, sheet_name, _, _, text) in enumerate(cells):
+        for token in iter_refs(text):
+            ref_file = external_refs.get(token.book, token.book) if token.book else file_name
+            ref_sheet = token.sheet or sheet_name
+            bounds = bounds_of.get(token.area)
+            if bounds is None:
+                bounds = bounds_of[token.area] = area_bounds(token.area)
+            top, left, bottom, right = bounds
+            if top == bottom and left == right:
+                key = (ref_file, ref_sheet, top, left)
+            else:
+                key = (ref_file, ref_sheet, top, left, bottom, right)
+                if key not in ids:
+                    ranges.append(node_for(key))
+            sources.append(node_for(key))
+            targets.append(target)
+
+    # Formula cells per sheet both by row and by column, so each range is searched
+    # along its shorter side: a one-row SUM over 12 columns is one row lookup
+    by_row = defaultdict(lambda: defaultdict(list))
+    by_col = defaultdict(lambda: defaultdict(list))
+    for i in range(formula_count):
+        f, s, r, c = nodes[i]
+        by_row[(f, s)][r].append((c, i))
+        by_col[(f, s)][c].append((r, i))
+    lines = {}
+    for index in (by_row, by_col):
+        for key, sheet_lines in index.items():
+            for members in sheet_lines.values():
+                members.sort()
+            lines[(index is by_row, key)] = (sorted(sheet_lines), sheet_lines)
+
+    for range_id in ranges:
+        f, s, top, left, bottom, right = nodes[range_id]
+        along_rows = bottom - top <= right - left
+        found = lines.get((along_rows, (f, s)))
+        if found is None:
+            continue
+        keys, sheet_lines = found
+        first, last, low, high = (top, bottom, left, right) if along_rows else (left, right, top, bottom)
+        for line in keys[bisect_left(keys, first):bisect_right(keys, last)]:
+            members = sheet_lines[line]
+            for _, member in members[bisect_left(members, (low, -1)):bisect_right(members, (high, formula_count))]:
+                sources.append(member)
+                targets.append(range_id)
+
+    return CellGraph(nodes, formula_count, sources, targets)
+
+
+def named_range_cells(data):
+    # The formula cells extracted for every named range, as build_cell_graph input
+    for name, (file_name, sheet_name, *_bounds) in data["named_ref_info"].items():
+        for row in data["named_ref_cells"][name]:
+            for r, c, value in row:
+                if value is not None:
+                    yield file_name, sheet_name, r, c, cell_formula_text(value)
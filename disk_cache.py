@@ -0,0 +1,83 @@
+# disk_cache.py
+import hashlib
+import os
+import pickle
+import tempfile
+import zlib
+
+# Bump whenever parsed or remapped structures change shape, so stale entries are ignored
+CACHE_VERSION = 11
+
+CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ai-excel-documentation"))
+MAX_CACHE_BYTES = int(os.getenv("MODEL_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+disk_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def cache_key(*parts):
+    digest = hashlib.sha256(f"v{CACHE_VERSION}".encode())
+    for part in parts:
+        digest.update(b"\0")
+        digest.update(repr(part).encode())
+    return digest.hexdigest()
+
+
+def _path(kind, key):
+    return os.path.join(CACHE_DIR, f"{kind}-{key}.pkl.z")
+
+
+def load(kind, key):
+    path = _path(kind, key)
+    try:
+        with open(path, "rb") as f:
+            value = pickle.loads(zlib.decompress(f.read()))
+    except (OSError, zlib.error, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        disk_cache_stats["misses"] += 1
+        return None
+    # mtime doubles as the LRU clock
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    disk_cache_stats["hits"] += 1
+    return value
+
+
+def store(kind, key, value):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        payload = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 6)
+        if len(payload) > MAX_CACHE_BYTES:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, _path(kind, key))
+        evict()
+    except (OSError, pickle.PicklingError, TypeError):
+        pass
+
+
+def evict(max_bytes=None):
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    entries = []
+    total = 0
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith(".pkl.z"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            disk_cache_stats["evictions"] += 1
+        except OSError:
+            pass
+
+
+def clear():
+    evict(max_bytes=0)
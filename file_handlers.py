@@ -1,53 +1,199 @@
 # file_handlers.py
-from openpyxl import load_workbook
-from openpyxl.utils import get_column_letter
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from io import BytesIO
+from openpyxl import load_workbook
+from openpyxl.utils.cell import range_boundaries
+import disk_cache
+from workbook_cache import file_bytes_of, upload_hash
+from ooxml_extractor import extract_named_ranges
+from named_index import NamedRangeIndex
+
+
+def _named_destinations(wb):
+    for name in wb.defined_names:
+        dn = wb.defined_names[name]
+        if dn.is_external or not dn.attr_text:
+            continue
+        for sheet_name, ref in dn.destinations:
+            try:
+                ref_clean = ref.replace("$", "").split("!")[-1]
+                min_col, min_row, max_col, max_row = range_boundaries(ref_clean)
+            except Exception:
+                continue
+            yield name, sheet_name, (min_row, min_col, max_row, max_col)
+
+
+def _read_named_ranges(wb):
+    named_ranges = []
+    for name, sheet_name, (min_row, min_col, max_row, max_col) in _named_destinations(wb):
+        try:
+            ws = wb[sheet_name]
+            cells = ws.iter_rows(min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col)
+            rows = [[(cell.row, cell.column, cell.value) for cell in row] for row in cells]
+        except Exception:
+            continue
+        named_ranges.append((name, sheet_name, min_row, min_col, rows))
+    return named_ranges
+
+
+def _read_named_ranges_streaming(file_bytes):
+    # Read-only pass: only sheets touched by a defined name are iterated, and
+    # only cells inside a destination rectangle are kept
+    wb = load_workbook(BytesIO(file_bytes), read_only=True, data_only=False)
+    try:
+        rects_by_sheet = defaultdict(list)
+        for name, sheet_name, rect in _named_destinations(wb):
+            rects_by_sheet[sheet_name].append((name, rect))
+
+        named_ranges = []
+        for sheet_name, named_rects in rects_by_sheet.items():
+            if sheet_name not in wb.sheetnames:
+                continue
+            ws = wb[sheet_name]
+            top = min(rect[0] for _, rect in named_rects)
+            left = min(rect[1] for _, rect in named_rects)
+            bottom = max(rect[2] for _, rect in named_rects)
+            right = max(rect[3] for _, rect in named_rects)
+
+            kept = [{} for _ in named_rects]
+            for r, row in enumerate(ws.iter_rows(min_row=top, max_row=bottom, min_col=left, max_col=right, values_only=True), start=top):
+                for i, (_, (min_row, min_col, max_row, max_col)) in enumerate(named_rects):
+                    if min_row <= r <= max_row:
+                        for c in range(min_col, max_col + 1):
+                            value = row[c - left] if c - left < len(row) else None
+                            if value is not None:
+                                kept[i][(r, c)] = value
+
+            for (name, (min_row, min_col, max_row, max_col)), values in zip(named_rects, kept):
+                rows = [
+                    [(r, c, values.get((r, c))) for c in range(min_col, max_col + 1)]
+                    for r in range(min_row, max_row + 1)
+                ]
+                named_ranges.append((name, sheet_name, min_row, min_col, rows))
+        return named_ranges
+    finally:
+        wb.close()
+
+
+INGESTION_MODES = ("full", "streaming", "native")
+DEFAULT_WORKERS = int(os.getenv("PARSE_WORKERS", min(4, os.cpu_count() or 1)))
+
 
-def handle_uploaded_files(uploaded_files):
-    all_named_cell_map = {}
+def _file_model(display_name, named_ranges):
+    named_ref_info = {}
+    named_ref_formulas = {}
+    named_ref_cells = {}
+
+    for name, sheet_name, min_row, min_col, rows in named_ranges:
+        formulas_for_graph = []
+        for row in rows:
+            for r, c, value in row:
+                if isinstance(value, str) and value.startswith("="):
+                    formulas_for_graph.append(value.strip())
+                elif value is not None:
+                    formulas_for_graph.append(str(value))
+        max_row = min_row + len(rows) - 1
+        max_col = min_col + (len(rows[0]) if rows else 1) - 1
+        named_ref_info[name] = (display_name, sheet_name, min_row, min_col, max_row, max_col)
+        named_ref_formulas[name] = formulas_for_graph
+        named_ref_cells[name] = rows
+
+    return {
+        "named_ref_info": named_ref_info,
+        "named_ref_formulas": named_ref_formulas,
+        "named_ref_cells": named_ref_cells
+    }
+
+
+def parse_file_bytes(file_bytes, display_name, mode):
+    # Module level and bytes-only so it can run in a worker process
+    if mode == "native":
+        named_ranges = extract_named_ranges(file_bytes)
+    elif mode == "streaming":
+        named_ranges = _read_named_ranges_streaming(file_bytes)
+    else:
+        # Loaded directly: a workbook cached in a worker process would just be thrown away
+        named_ranges = _read_named_ranges(load_workbook(BytesIO(file_bytes)))
+    return _file_model(display_name, named_ranges)
+
+
+def _parse_files(pending, mode, workers):
+    # pending: {display_name: file_bytes}; returns ({display_name: model}, {display_name: error})
+    models, errors = {}, {}
+    if workers <= 1 or len(pending) <= 1:
+        for display_name, file_bytes in pending.items():
+            try:
+                models[display_name] = parse_file_bytes(file_bytes, display_name, mode)
+            except Exception as e:
+                errors[display_name] = f"{type(e).__name__}: {e}"
+        return models, errors
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+        futures = {
+            pool.submit(parse_file_bytes, file_bytes, display_name, mode): display_name
+            for display_name, file_bytes in pending.items()
+        }
+        for future in as_completed(futures):
+            display_name = futures[future]
+            try:
+                models[display_name] = future.result()
+            except Exception as e:
+                errors[display_name] = f"{type(e).__name__}: {e}"
+    return models, errors
+
+
+def handle_uploaded_files(uploaded_files, mode="full", use_disk_cache=True, workers=None):
+    named_index = NamedRangeIndex()
     all_named_ref_info = {}
     file_display_names = {}
     named_ref_formulas = {}
+    named_ref_cells = {}
+    file_hashes = {}
+    file_errors = {}
 
+    models = {}
+    cache_keys = {}
+    pending = {}
     for uploaded_file in uploaded_files:
         display_name = uploaded_file.name
         file_display_names[display_name] = uploaded_file
-        wb = load_workbook(BytesIO(uploaded_file.read()), data_only=False)
+        file_hashes[display_name] = upload_hash(uploaded_file)
 
-        for name in wb.defined_names:
-            dn = wb.defined_names[name]
-            if dn.is_external or not dn.attr_text:
-                continue
-            for sheet_name, ref in dn.destinations:
-                try:
-                    ws = wb[sheet_name]
-                    ref_clean = ref.replace("$", "").split("!")[-1]
-                    cells = ws[ref_clean] if ":" in ref_clean else [[ws[ref_clean]]]
-
-                    min_row = min(cell.row for row in cells for cell in row)
-                    min_col = min(cell.column for row in cells for cell in row)
-
-                    coord_set = set()
-                    formulas_for_graph = []
-                    for row in cells:
-                        for cell in row:
-                            r, c = cell.row, cell.column
-                            row_offset = r - min_row + 1
-                            col_offset = c - min_col + 1
-                            all_named_cell_map[(display_name, sheet_name, r, c)] = (name, row_offset, col_offset)
-                            coord_set.add((r, c))
-                            if isinstance(cell.value, str) and cell.value.startswith("="):
-                                formulas_for_graph.append(cell.value.strip())
-                            elif cell.value is not None:
-                                formulas_for_graph.append(str(cell.value))
-                    all_named_ref_info[name] = (display_name, sheet_name, coord_set, min_row, min_col)
-                    named_ref_formulas[name] = formulas_for_graph
-                except Exception:
-                    continue
+        # The parsed model only depends on the bytes and the name it is shown under
+        key = cache_keys[display_name] = disk_cache.cache_key("parse", file_hashes[display_name], display_name, mode)
+        model = disk_cache.load("parse", key) if use_disk_cache else None
+        if model is None:
+            pending[display_name] = file_bytes_of(uploaded_file)
+        else:
+            models[display_name] = model
+
+    if pending:
+        parsed, file_errors = _parse_files(pending, mode, workers or DEFAULT_WORKERS)
+        for display_name, model in parsed.items():
+            models[display_name] = model
+            if use_disk_cache:
+                disk_cache.store("parse", cache_keys[display_name], model)
+
+    # Merge in upload order so later files win name clashes, as before
+    for display_name in file_display_names:
+        model = models.get(display_name)
+        if model is None:
+            continue
+        for name, (file_name, sheet_name, *rect) in model["named_ref_info"].items():
+            named_index.add(file_name, sheet_name, name, *rect)
+        all_named_ref_info.update(model["named_ref_info"])
+        named_ref_formulas.update(model["named_ref_formulas"])
+        named_ref_cells.update(model["named_ref_cells"])
 
     return {
-        "named_cell_map": all_named_cell_map,
+        "named_index": named_index,
         "named_ref_info": all_named_ref_info,
         "file_display_names": file_display_names,
-        "named_ref_formulas": named_ref_formulas 
+        "named_ref_formulas": named_ref_formulas,
+        "named_ref_cells": named_ref_cells,
+        "file_hashes": file_hashes,
+        "file_errors": file_errors,
+        "ingestion_mode": mode
     }
@@ -0,0 +1,63 @@
+# file_session.py
+from io import BytesIO
+import pandas as pd
+from lru import LRUCache
+from sheet_flow import get_sheet_flow
+from workbook_cache import file_bytes_of, upload_hash
+
+MAX_SESSIONS = 8
+MAX_PAGES = 64
+
+_sessions = LRUCache(MAX_SESSIONS)
+
+
+class FileSession:
+    # Everything main.py reads from one upload. The file is opened once per content hash
+    # and sheets are read a page at a time, each page at most once.
+
+    def __init__(self, uploaded_file):
+        self.file_hash = upload_hash(uploaded_file)
+        self.file_name = getattr(uploaded_file, "name", "")
+        self._upload = uploaded_file
+        self._excel = pd.ExcelFile(BytesIO(file_bytes_of(uploaded_file)))
+        self.sheet_names = self._excel.sheet_names
+        self._pages = LRUCache(MAX_PAGES)
+
+    def row_count(self, sheet_name):
+        # Data rows below the header, from the sheet dimensions rather than a full read
+        book = self._excel.book
+        try:
+            rows = book[sheet_name].max_row
+        except TypeError:
+            rows = book.sheet_by_name(sheet_name).nrows
+        return max((rows or 0) - 1, 0)
+
+    def page(self, sheet_name, offset=0, size=100):
+        # Rows offset .. offset + size - 1 under the header row; only that window is kept,
+        # and the reader stops once it has the last row of the page
+        key = (sheet_name, offset, size)
+        frame = self._pages.get(key)
+        if frame is not None:
+            return frame
+
+        frame = self._excel.parse(sheet_name, skiprows=range(1, offset + 1), nrows=size)
+        frame.index = range(offset, offset + len(frame))
+        return self._pages.put(key, frame)
+
+    def sample(self, sheet_name, rows=5):
+        return self.page(sheet_name, 0, rows).to_dict()
+
+    def sheet_flow(self):
+        # Formulas come from a separate read-only pass, itself cached by content hash;
+        # .xls files have no formula scan
+        if self.file_name.lower().endswith(".xls"):
+            return {}
+        return get_sheet_flow(self._upload)
+
+
+def get_file_session(uploaded_file):
+    key = upload_hash(uploaded_file)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+    return _sessions.put(key, FileSession(uploaded_file))
@@ -0,0 +1,178 @@
+# formula_classes.py
+import re
+from collections import defaultdict, namedtuple
+from formula_tokenizer import rewrite_areas, MAX_ROW, MAX_COL, column_index
+
+_endpoint_re = re.compile(r"^(\$?)([A-Z]{1,3})?(\$?)([0-9]{1,7})?$")
+_endpoint_cache = {}
+MAX_CACHED_AREAS = 100000
+
+# canonical: relative R1C1 text shared by every member; formula: the anchor cell's
+# formula (first member in row-major order); rects: members as (min_row, min_col, max_row, max_col)
+FormulaClass = namedtuple("FormulaClass", "canonical formula anchor rects count")
+
+CONSTANT = "<constant>"
+
+
+def _endpoints(area):
+    # [(col, col_abs, row, row_abs)] for each side of the area; whole rows/columns leave col/row None
+    parts = _endpoint_cache.get(area)
+    if parts is not None:
+        return parts
+    # Built whole before it is cached, so another session's thread never sees it half-filled
+    parts = []
+    for side in area.split(":"):
+        m = _endpoint_re.match(side)
+        col_abs, col_str, row_abs, row_str = m.groups()
+        parts.append((
+            column_index(col_str) if col_str else None, bool(col_abs),
+            int(row_str) if row_str else None, bool(row_abs)
+        ))
+    if len(_endpoint_cache) >= MAX_CACHED_AREAS:
+        _endpoint_cache.clear()
+    _endpoint_cache[area] = parts
+    return parts
+
+
+def to_r1c1(formula, row, col):
+    def relative(area):
+        sides = []
+        for c, c_abs, r, r_abs in _endpoints(area):
+            text = ""
+            if r is not None:
+                text += f"R{r}" if r_abs else f"R[{r - row}]"
+            if c is not None:
+                text += f"C{c}" if c_abs else f"C[{c - col}]"
+            sides.append(text)
+        return ":".join(sides)
+    return rewrite_areas(formula, relative)
+
+
+def swept_area(area, anchor, bounds):
+    # The area a relative reference covers when the anchor's formula is copied over bounds
+    anchor_row, anchor_col = anchor
+    min_row, min_col, max_row, max_col = bounds
+    rows, cols = [], []
+    for c, c_abs, r, r_abs in _endpoints(area):
+        if r is None:
+            rows += [1, MAX_ROW]
+        elif r_abs:
+            rows.append(r)
+        else:
+            rows += [r - anchor_row + min_row, r - anchor_row + max_row]
+        if c is None:
+            cols += [1, MAX_COL]
+        elif c_abs:
+            cols.append(c)
+        else:
+            cols += [c - anchor_col + min_col, c - anchor_col + max_col]
+    top, bottom = max(min(rows), 1), min(max(rows), MAX_ROW)
+    left, right = max(min(cols), 1), min(max(cols), MAX_COL)
+    if top > bottom or left > right:
+        return None
+    return top, left, bottom, right
+
+
+def swept_areas(area, anchor, rects):
+    # swept_area over each rectangle of a class, merged into disjoint rectangles. Cells
+    # between separate rectangles are not swept in, since no copy of the formula sits there.
+    swept = (swept_area(area, anchor, rect) for rect in rects)
+    return merge_rects([rect for rect in swept if rect is not None])
+
+
+def cells_to_rects(cells):
+    # Row-major cells -> rectangles: runs along each row, then stacked runs merged downwards
+    runs = []
+    for r, c in sorted(cells):
+        if runs and runs[-1][0] == r and runs[-1][2] == c - 1:
+            runs[-1][2] = c
+        else:
+            runs.append([r, c, c])
+
+    open_rects = {}
+    rects = []
+    for r, c0, c1 in runs:
+        rect = open_rects.get((c0, c1))
+        if rect is not None and rect[2] == r - 1:
+            rect[2] = r
+        else:
+            rect = [r, c0, r, c1]
+            rects.append(rect)
+            open_rects[(c0, c1)] = rect
+    return [tuple(rect) for rect in rects]
+
+
+def merge_rects(rects):
+    # Union of possibly overlapping rectangles as disjoint ones: merge column runs
+    # inside each row band, then extend a rectangle down while its run repeats
+    if not rects:
+        return []
+    edges = sorted({rect[0] for rect in rects} | {rect[2] + 1 for rect in rects})
+    starting = defaultdict(list)
+    for rect in rects:
+        starting[rect[0]].append(rect)
+
+    merged = []
+    active = []
+    open_runs = {}
+    for top, next_top in zip(edges, edges[1:]):
+        bottom = next_top - 1
+        active = [rect for rect in active if rect[2] >= top] + starting.get(top, [])
+        runs = []
+        for left, right in sorted((rect[1], rect[3]) for rect in active):
+            if runs and left <= runs[-1][1] + 1:
+                runs[-1][1] = max(runs[-1][1], right)
+            else:
+                runs.append([left, right])
+
+        still_open = {}
+        for left, right in runs:
+            rect = open_runs.get((left, right))
+            if rect is not None and rect[2] == top - 1:
+                rect[2] = bottom
+            else:
+                rect = [top, left, bottom, right]
+                merged.append(rect)
+            still_open[(left, right)] = rect
+        open_runs = still_open
+    return [tuple(rect) for rect in merged]
+
+
+def summarize_constants(values):
+    # One value as itself; numbers as their count and range; anything else as a count and examples
+    distinct = list(dict.fromkeys(values))
+    if len(distinct) == 1:
+        return distinct[0]
+    try:
+        numbers = [float(value) for value in values]
+    except ValueError:
+        examples = ", ".join(distinct[:3])
+        more = ", …" if len(distinct) > 3 else ""
+        return f"{len(values)} constant values ({len(distinct)} distinct: {examples}{more})"
+    return f"{len(values)} constant values from {min(numbers):g} to {max(numbers):g}"
+
+
+def classify_formulas(cell_formulas):
+    # cell_formulas: iterable of (row, col, formula_or_value) in row-major order.
+    # Formulas sharing a relative R1C1 form become one class; plain values share one class,
+    # whose formula summarizes the values rather than picking one of them.
+    order = []
+    members = {}
+    first = {}
+    constants = []
+    for r, c, text in cell_formulas:
+        canonical = to_r1c1(text, r, c) if text.startswith("=") else CONSTANT
+        if canonical not in members:
+            order.append(canonical)
+            members[canonical] = []
+            first[canonical] = (text, (r, c))
+        members[canonical].append((r, c))
+        if canonical == CONSTANT:
+            constants.append(text)
+    if constants:
+        first[CONSTANT] = (summarize_constants(constants), first[CONSTANT][1])
+
+    return [
+        FormulaClass(canonical, first[canonical][0], first[canonical][1], cells_to_rects(members[canonical]), len(members[canonical]))
+        for canonical in order
+    ]
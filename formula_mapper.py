@@ -1,93 +1,223 @@
 # formula_mapper.py
+import os
 import re
-from openpyxl.utils import column_index_from_string, get_column_letter
+from collections import defaultdict
+from openpyxl.utils import get_column_letter
+import disk_cache
+from lru import LRUCache
+from formula_tokenizer import rewrite_refs, area_bounds
+from formula_classes import CONSTANT, classify_formulas, swept_areas
 
-def remap_formula(formula, current_file, current_sheet, all_named_cell_map, external_refs):
+DISPLAY_LIMIT = 50
+MAX_REMAPS = int(os.getenv("REMAP_CACHE_SIZE", 100000))
+
+# Remapped text, keyed by formula and index version
+_remaps = LRUCache(MAX_REMAPS)
+remap_cache_stats = {"hits": 0, "misses": 0}
+
+
+def slice_label(first, last):
+    return f"[{first}]" if first == last else f"[{first}:{last}]"
+
+
+def range_address(top, left, bottom, right):
+    start = f"{get_column_letter(left)}{top}"
+    if (top, left) == (bottom, right):
+        return start
+    return f"{start}:{get_column_letter(right)}{bottom}"
+
+
+def remap_reference(token, current_file, current_sheet, named_index, external_refs):
+    if token.book:
+        external_file = external_refs.get(token.book, token.book)
+        return f"[{external_file}]{token.text}"
+
+    sheet_name = token.sheet or current_sheet
+    top, left, bottom, right = area_bounds(token.area)
+    if (top, left) == (bottom, right):
+        hit = named_index.lookup(current_file, sheet_name, top, left)
+        if hit:
+            name, r_off, c_off = hit
+            return f"[{current_file}]{name}[{r_off}][{c_off}]"
+        return f"{sheet_name}!{range_address(top, left, bottom, right)}"
+
+    # Intersect with the named rectangles instead of visiting every cell
+    pieces, leftovers = named_index.cover(current_file, sheet_name, top, left, bottom, right)
+    label_set = set()
+    for name, rows, cols in pieces:
+        label_set.add(f"[{current_file}]{name}{slice_label(*rows)}{slice_label(*cols)}")
+    for top, left, bottom, right in leftovers:
+        label_set.add(f"{sheet_name}!{range_address(top, left, bottom, right)}")
+    return ", ".join(sorted(label_set))
+
+
+def _memoized(key, compute):
+    remapped = _remaps.get(key)
+    if remapped is None:
+        remap_cache_stats["misses"] += 1
+        return _remaps.put(key, compute())
+    remap_cache_stats["hits"] += 1
+    return remapped
+
+
+def clear_remap_cache():
+    _remaps.clear()
+    remap_cache_stats["hits"] = 0
+    remap_cache_stats["misses"] = 0
+
+
+def remap_cache_hit_rate():
+    total = remap_cache_stats["hits"] + remap_cache_stats["misses"]
+    return remap_cache_stats["hits"] / total if total else 0.0
+
+
+def remap_formula(formula, current_file, current_sheet, named_index, external_refs):
     if not formula:
         return ""
 
-    def cell_address(row, col):
-        return f"{get_column_letter(col)}{row}"
-
-    def remap_single_cell(ref, default_file, default_sheet):
-        match = re.match(r"(?:'([^']+)'|([^'!]+))!([$A-Z]+[0-9]+)", ref)
-        if match:
-            sheet_name = match.group(1) or match.group(2)
-            addr = match.group(3)
-            external_match = re.match(r"\[(\d+)\]", sheet_name)
-            if external_match:
-                external_ref = external_match.group(0)
-                external_file = external_refs.get(external_ref, external_ref)
-                return f"[{external_file}]{ref}"
-        else:
-            sheet_name = default_sheet
-            addr = ref
-
-        addr = addr.replace("$", "").upper()
-        match = re.match(r"([A-Z]+)([0-9]+)", addr)
-        if not match:
-            return ref
-        col_str, row_str = match.groups()
-        row = int(row_str)
-        col = column_index_from_string(col_str)
-
-        key = (default_file, sheet_name, row, col)
-        if key in all_named_cell_map:
-            name, r_off, c_off = all_named_cell_map[key]
-            return f"[{default_file}]{name}[{r_off}][{c_off}]"
-        else:
-            return f"{sheet_name}!{addr}"
-
-    def remap_range(ref, default_file, default_sheet):
-        if ref.startswith("["):
-            match = re.match(r"\[(\d+)\]", ref)
-            if match:
-                external_ref = match.group(0)
-                external_file = external_refs.get(external_ref, external_ref)
-                return f"[{external_file}]{ref}"
-
-        match = re.match(r"(?:'([^']+)'|([^'!]+))!([$A-Z]+[0-9]+(?::[$A-Z]+[0-9]+)?)", ref)
-        if match:
-            sheet_name = match.group(1) or match.group(2)
-            addr = match.group(3)
-        else:
-            sheet_name = default_sheet
-            addr = ref
-
-        addr = addr.replace("$", "").upper()
-        if ":" not in addr:
-            return remap_single_cell(ref, default_file, default_sheet)
-
-        start, end = addr.split(":")
-        m1 = re.match(r"([A-Z]+)([0-9]+)", start)
-        m2 = re.match(r"([A-Z]+)([0-9]+)", end)
-        if not m1 or not m2:
-            return ref
-        start_col = column_index_from_string(m1.group(1))
-        start_row = int(m1.group(2))
-        end_col = column_index_from_string(m2.group(1))
-        end_row = int(m2.group(2))
-
-        label_set = set()
-        for row in range(start_row, end_row + 1):
-            for col in range(start_col, end_col + 1):
-                key = (default_file, sheet_name, row, col)
-                if key in all_named_cell_map:
-                    name, r_off, c_off = all_named_cell_map[key]
-                    label_set.add(f"[{default_file}]{name}[{r_off}][{c_off}]")
-                else:
-                    label_set.add(f"{sheet_name}!{get_column_letter(col)}{row}")
-        return ", ".join(sorted(label_set))
-
-    pattern = r"(?<![A-Za-z0-9_])(?:'[^']+'|[A-Za-z0-9_]+)!\$?[A-Z]{1,3}\$?[0-9]{1,7}(?::\$?[A-Z]{1,3}\$?[0-9]{1,7})?|(?<![A-Za-z0-9_])\$?[A-Z]{1,3}\$?[0-9]{1,7}(?::\$?[A-Z]{1,3}\$?[0-9]{1,7})?"
-    matches = list(re.finditer(pattern, formula))
-    replaced_formula = formula
-    offset = 0
-    for match in matches:
-        raw = match.group(0)
-        remapped = remap_range(raw, current_file, current_sheet)
-        start, end = match.start() + offset, match.end() + offset
-        replaced_formula = replaced_formula[:start] + remapped + replaced_formula[end:]
-        offset += len(remapped) - len(raw)
-
-    return replaced_formula
+    # One linear pass; only reference tokens are rewritten
+    def compute():
+        return rewrite_refs(
+            formula,
+            lambda token: remap_reference(token, current_file, current_sheet, named_index, external_refs)
+        )
+    key = ("formula", formula, current_file, current_sheet, named_index.version, tuple(sorted(external_refs.items())))
+    return _memoized(key, compute)
+
+
+def cell_formula_text(value):
+    if isinstance(value, str) and value.startswith("="):
+        return value.strip()
+    if hasattr(value, 'text'):
+        return str(value.text).strip()
+    return str(value)
+
+
+def remap_class(formula_class, file_name, sheet_name, named_index, external_refs):
+    # The class formula with each relative reference widened to the areas its copies cover,
+    # one per rectangle of copies after merging
+    if formula_class.canonical == CONSTANT:
+        return formula_class.formula
+    rects = tuple(formula_class.rects)
+
+    def compute():
+        def widen(token):
+            if token.book:
+                return remap_reference(token, file_name, sheet_name, named_index, external_refs)
+            swept = swept_areas(token.area, formula_class.anchor, rects)
+            if not swept:
+                return token.text
+            labels = (
+                remap_reference(token._replace(area=range_address(*rect)), file_name, sheet_name, named_index, external_refs)
+                for rect in swept
+            )
+            return ", ".join(dict.fromkeys(labels))
+        return rewrite_refs(formula_class.formula, widen)
+    # The canonical form plus where the copies sit fixes the result, whichever cell is the anchor
+    key = (
+        "class", formula_class.canonical, rects, file_name, sheet_name,
+        named_index.version, tuple(sorted(external_refs.items()))
+    )
+    return _memoized(key, compute)
+
+
+def remap_named_range(name, info, cells, named_index, external_refs, limit=DISPLAY_LIMIT):
+    # Per-cell remapping is only done for the cells shown; everything else works per formula class
+    file_name, sheet_name, min_row, min_col, max_row, max_col = info
+    entries = []
+    cell_texts = []
+    corners = {(min_row, min_col): None, (min_row, max_col): None, (max_row, min_col): None, (max_row, max_col): None}
+
+    try:
+        for row in cells:
+            for cell_row, cell_col, value in row:
+                # Empty cells are neither constants nor formulas
+                if value is None:
+                    continue
+                try:
+                    formula = cell_formula_text(value)
+                except Exception as e:
+                    formula = f"[error reading cell: {e}]"
+                cell_texts.append((cell_row, cell_col, formula))
+                if (cell_row, cell_col) in corners:
+                    corners[(cell_row, cell_col)] = formula
+
+                if len(entries) < limit:
+                    row_offset = cell_row - min_row + 1
+                    col_offset = cell_col - min_col + 1
+                    label = f"{name}[{row_offset}][{col_offset}]"
+                    try:
+                        remapped = remap_formula(formula, file_name, sheet_name, named_index, external_refs)
+                    except Exception as e:
+                        remapped = f"[error remapping cell: {e}]"
+                    entries.append(f"{label} = {formula}\n → {remapped}")
+
+        classes = classify_formulas(cell_texts)
+        formulas_for_graph = [
+            remap_formula(c.formula, file_name, sheet_name, named_index, external_refs) if c.canonical != CONSTANT else c.formula
+            for c in classes
+        ]
+        swept = [remap_class(c, file_name, sheet_name, named_index, external_refs) for c in classes]
+        # Corner cells, labelled with their position, for prompts that want the range's edges
+        boundary = [
+            f"{name}[{r - min_row + 1}][{c - min_col + 1}] = "
+            + (remap_formula(text, file_name, sheet_name, named_index, external_refs) if text.startswith("=") else text)
+            for (r, c), text in sorted(corners.items()) if text is not None
+        ]
+    except Exception as e:
+        entries.append(f"❌ Error accessing {name} in {sheet_name}: {e}")
+        classes, formulas_for_graph, swept, boundary = [], [], [], []
+
+    return {
+        "entries": entries,
+        "cell_count": len(cell_texts),
+        "classes": classes,
+        "formulas": formulas_for_graph,
+        "swept": swept,
+        "boundary": boundary
+    }
+
+
+# Strings, quoted sheets and bracketed parts ([file], [1:5]) are skipped; what is left
+# are identifier-shaped words, each compared whole against the defined names
+_word_re = re.compile(r'"(?:[^"]|"")*"|\'(?:[^\']|\'\')*\'|\[[^\]]*\]|(?<![\w.])([A-Za-z_\\][\w.?\\]*)')
+
+
+def find_dependencies(formulas_by_name):
+    # One pass over all formula text; a name set lookup per word instead of one regex per name
+    names = {name.casefold(): name for name in formulas_by_name}
+    dependencies = defaultdict(set)
+    for target, formulas in formulas_by_name.items():
+        for formula in formulas:
+            for word in _word_re.findall(formula):
+                source = names.get(word.casefold()) if word else None
+                if source is not None and source != target:
+                    dependencies[target].add(source)
+    return dependencies
+
+
+def remap_named_ranges(data, external_refs, use_disk_cache=True):
+    # Remapping depends on every parsed file (names resolve across files) and the external
+    # mapping. Files that failed to parse are left out of the key, so a run missing their
+    # names is never replayed once they parse.
+    parsed_files = sorted(
+        (name, digest) for name, digest in data["file_hashes"].items() if name not in data.get("file_errors", {})
+    )
+    key = disk_cache.cache_key(
+        "remap",
+        parsed_files,
+        data.get("ingestion_mode"),
+        sorted(external_refs.items())
+    )
+    results = disk_cache.load("remap", key) if use_disk_cache else None
+    if results is not None:
+        return results
+
+    results = {}
+    for name, info in data["named_ref_info"].items():
+        results[name] = remap_named_range(
+            name, info, data["named_ref_cells"][name], data["named_index"], external_refs
+        )
+    if use_disk_cache:
+        disk_cache.store("remap", key, results)
+    return results
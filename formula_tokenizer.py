@@ -0,0 +1,122 @@
+# formula_tokenizer.py
+import re
+from collections import namedtuple
+from openpyxl.utils import column_index_from_string
+
+MAX_ROW = 1048576
+MAX_COL = 16384
+
+# kind: STRING, ERROR, REF, FUNCTION, STRUCTURED, NUMBER, NAME, SPACE, OP
+# For REF tokens: book is the external prefix ("[1]") if any, sheet the unquoted
+# sheet name if qualified, and area the reference after the "!" (or the whole text).
+Token = namedtuple("Token", "kind text book sheet area")
+
+_SHEET = r"(?:'(?P<qsheet>(?:\[(?P<qbook>[^\]]+)\])?(?:[^']|'')+)'|(?:\[(?P<book>\d+)\])?(?P<sheet>[A-Za-z_\\][\w.]*))!"
+_CELL = r"\$?[A-Z]{1,3}\$?[0-9]{1,7}"
+_AREA = (
+    rf"(?P<area>{_CELL}(?::{_CELL})?"
+    r"|\$?[A-Z]{1,3}:\$?[A-Z]{1,3}"
+    r"|\$?[0-9]{1,7}:\$?[0-9]{1,7})"
+)
+
+_token_re = re.compile(
+    r'(?P<STRING>"(?:[^"]|"")*"?)'
+    r"|(?P<ERROR>#(?:NULL!|DIV/0!|VALUE!|REF!|NAME\?|NUM!|N/A|GETTING_DATA|SPILL!|CALC!))"
+    rf"|(?P<REF>(?<![\w.$])(?:{_SHEET})?{_AREA}(?![\w(.!\[]))"
+    r"|(?P<FUNCTION>[A-Za-z_][\w.]*(?=\())"
+    r"|(?P<STRUCTURED>[A-Za-z_\\][\w.]*\[(?:[^\[\]]|\[[^\]]*\])*\])"
+    r"|(?P<NUMBER>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)"
+    r"|(?P<NAME>[A-Za-z_\\][\w.?\\]*)"
+    r"|(?P<SPACE>\s+)"
+    r"|(?P<OP>.)",
+    re.S
+)
+
+# Only what can hide or hold a reference: string literals, references and bracketed
+# structured-reference parts; everything in between is copied through by re.sub
+_ref_scan_re = re.compile(
+    r'(?P<STRING>"(?:[^"]|"")*"?)'
+    rf"|(?P<REF>(?<![\w.$])(?:{_SHEET})?{_AREA}(?![\w(.!\[]))"
+    r"|(?P<BRACKET>\[(?:[^\[\]]|\[[^\]]*\])*\])",
+    re.S
+)
+
+_cell_parts_re = re.compile(r"\$?([A-Z]{1,3})\$?([0-9]{1,7})$")
+_col_cache = {}
+
+
+def _ref_token(m):
+    qsheet = m.group("qsheet")
+    if qsheet is not None:
+        qbook = m.group("qbook")
+        sheet = qsheet.replace("''", "'")
+        if qbook is not None:
+            sheet = sheet[len(qbook) + 2:]
+            book = f"[{qbook}]"
+        else:
+            book = None
+    else:
+        sheet = m.group("sheet")
+        book = f"[{m.group('book')}]" if m.group("book") else None
+    return Token("REF", m.group(0), book, sheet, m.group("area"))
+
+
+def tokenize(formula):
+    tokens = []
+    append = tokens.append
+    for m in _token_re.finditer(formula):
+        kind = m.lastgroup
+        if kind == "REF":
+            append(_ref_token(m))
+        else:
+            append(Token(kind, m.group(0), None, None, None))
+    return tokens
+
+
+def rewrite_refs(formula, replace):
+    # Same references as tokenize(), but the text between them never reaches Python
+    def substitute(m):
+        if m.lastgroup == "REF":
+            return replace(_ref_token(m))
+        return m.group(0)
+    return _ref_scan_re.sub(substitute, formula)
+
+
+def rewrite_areas(formula, replace):
+    # Cheaper rewrite_refs for callers that only change the area: replace(area) -> text
+    def substitute(m):
+        if m.lastgroup == "REF":
+            area = m.group("area")
+            text = m.group(0)
+            return text[:len(text) - len(area)] + replace(area)
+        return m.group(0)
+    return _ref_scan_re.sub(substitute, formula)
+
+
+def iter_refs(formula):
+    for m in _ref_scan_re.finditer(formula):
+        if m.lastgroup == "REF":
+            yield _ref_token(m)
+
+
+def column_index(col_str):
+    col = _col_cache.get(col_str)
+    if col is None:
+        col = _col_cache[col_str] = column_index_from_string(col_str)
+    return col
+
+
+def area_bounds(area):
+    # (min_row, min_col, max_row, max_col) for a cell, range, whole column or whole row
+    area = area.replace("$", "")
+    start, _, end = area.partition(":")
+    end = end or start
+    if start.isdigit():
+        return int(start), 1, int(end), MAX_COL
+    if start.isalpha():
+        return 1, column_index(start), MAX_ROW, column_index(end)
+    m1 = _cell_parts_re.match(start)
+    m2 = _cell_parts_re.match(end)
+    r1, c1 = int(m1.group(2)), column_index(m1.group(1))
+    r2, c2 = int(m2.group(2)), column_index(m2.group(1))
+    return min(r1, r2), min(c1, c2), max(r1, r2), max(c1, c2)
@@ -0,0 +1,127 @@
+# graph_view.py
+import hashlib
+from collections import Counter, defaultdict
+import graphviz
+import disk_cache
+from lru import LRUCache
+from cell_graph import CellGraph
+
+GROUPINGS = ("file", "sheet", "cycle")
+# Above this many names clusters start collapsed; graphviz layout gets slow and unreadable
+MAX_EXPANDED_NAMES = 300
+MAX_SVGS = 32
+
+_svgs = LRUCache(MAX_SVGS)
+
+
+def group_names(named_ref_info, dependencies, grouping):
+    # name -> group label; with "cycle" only names on a circular chain get a group
+    if grouping == "file":
+        return {name: info[0] for name, info in named_ref_info.items()}
+    if grouping == "sheet":
+        return {name: f"{info[0]} / {info[1]}" for name, info in named_ref_info.items()}
+
+    names = list(named_ref_info)
+    ids = {name: i for i, name in enumerate(names)}
+    sources, targets = [], []
+    for target, found in dependencies.items():
+        for source in found:
+            if source in ids and target in ids:
+                sources.append(ids[source])
+                targets.append(ids[target])
+    _, components = CellGraph(names, len(names), sources, targets).components()
+    groups = {}
+    for members in components:
+        if len(members) > 1:
+            label = f"cycle {names[min(members)]} +{len(members) - 1}"
+            for v in members:
+                groups[names[v]] = label
+    return groups
+
+
+def k_hop_names(dependencies, focus, hops):
+    # Names within hops edges of focus, following edges either way
+    neighbours = defaultdict(set)
+    for target, sources in dependencies.items():
+        for source in sources:
+            neighbours[target].add(source)
+            neighbours[source].add(target)
+    seen = {focus}
+    frontier = [focus]
+    for _ in range(hops):
+        frontier = [n for v in frontier for n in neighbours[v] if n not in seen]
+        seen.update(frontier)
+    return seen
+
+
+def build_view(named_ref_info, dependencies, grouping="file", expanded=None, focus=None, hops=1):
+    # Collapsed groups become one box node; edges between them are merged and counted
+    groups = group_names(named_ref_info, dependencies, grouping)
+    names = sorted(named_ref_info)
+    if focus is not None:
+        nearby = k_hop_names(dependencies, focus, hops)
+        names = [name for name in names if name in nearby]
+    if expanded is None:
+        expanded = set(groups.values()) if len(names) <= MAX_EXPANDED_NAMES else set()
+    visible = set(names)
+
+    def node_of(name):
+        group = groups.get(name)
+        return name if group is None or group in expanded else f"[group] {group}"
+
+    dot = graphviz.Digraph()
+    dot.attr(compound='true', rankdir='LR')
+
+    clusters = defaultdict(list)
+    collapsed = Counter()
+    for name in names:
+        if node_of(name) == name:
+            clusters[groups.get(name)].append(name)
+        else:
+            collapsed[groups[name]] += 1
+
+    for i, (group, members) in enumerate(sorted(clusters.items(), key=lambda item: item[0] or "")):
+        if group is None:
+            for member in members:
+                dot.node(member)
+            continue
+        with dot.subgraph(name=f"cluster_{i}") as c:
+            c.attr(label=group)
+            c.attr(style='filled', color='lightgrey')
+            for member in members:
+                c.node(member)
+    for group, count in sorted(collapsed.items()):
+        dot.node(f"[group] {group}", label=f"{group}\n({count} named ranges)", shape="box3d")
+
+    edges = Counter()
+    for target, sources in dependencies.items():
+        if target not in visible:
+            continue
+        for source in sources:
+            if source in visible and node_of(source) != node_of(target):
+                edges[(node_of(source), node_of(target))] += 1
+    for (source, target), count in sorted(edges.items()):
+        dot.edge(source, target, label=str(count) if count > 1 else None)
+
+    return dot
+
+
+def graph_hash(dot):
+    return hashlib.sha256(dot.source.encode()).hexdigest()
+
+
+def render_svg(dot):
+    # Layout is the slow part, so the SVG is kept per graph source in memory and on disk.
+    # Raises graphviz.ExecutableNotFound when the dot binary is not installed.
+    key = graph_hash(dot)
+    svg = _svgs.get(key)
+    if svg is not None:
+        return svg
+
+    svg = disk_cache.load("svg", key)
+    if svg is None:
+        svg = dot.pipe(format="svg").decode("utf-8")
+        # Drop the XML prolog so the markup can be embedded directly
+        svg = svg[svg.find("<svg"):]
+        disk_cache.store("svg", key, svg)
+    return _svgs.put(key, svg)
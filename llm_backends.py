@@ -0,0 +1,220 @@
+# llm_backends.py
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+# A backend turns one chat request into text. complete() returns the whole response;
+# stream() opens the request before returning, so connection errors surface there and can be
+# retried, then yields text pieces. Errors are raised as exceptions carrying status_code (and
+# response.headers for Retry-After) where there is one, which llm_engine classifies.
+# cacheable says whether responses may go into the persistent response cache.
+
+_piece_re = re.compile(r"\S+\s*|\s+")
+
+
+def request_key(model, messages, temperature):
+    payload = json.dumps([model, messages, temperature], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class OpenAIBackend:
+    name = "openai"
+    cacheable = True
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Created on first use, so importing llm_engine needs no key when another backend is used
+        with self._lock:
+            if self._client is None:
+                from openai import OpenAI
+                # Retries and backoff are handled by llm_engine, not the SDK
+                self._client = OpenAI(api_key=self.api_key or os.getenv("OPENAI_API_KEY"), max_retries=0)
+            return self._client
+
+    def complete(self, model, messages, temperature, timeout):
+        response = self.client.chat.completions.create(
+            model=model, messages=messages, temperature=temperature, timeout=timeout
+        )
+        return response.choices[0].message.content or ""
+
+    def stream(self, model, messages, temperature, timeout):
+        chunks = self.client.chat.completions.create(
+            model=model, messages=messages, temperature=temperature, timeout=timeout, stream=True
+        )
+        return self._pieces(chunks)
+
+    @staticmethod
+    def _pieces(chunks):
+        for chunk in chunks:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class StubError(Exception):
+    # Looks enough like an SDK status error for llm_engine to classify and honour Retry-After
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"stub backend returned HTTP {status_code}")
+        self.status_code = status_code
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        self.response = type("StubResponse", (), {"headers": headers})()
+
+
+class StubBackend:
+    # Local stand-in for load tests and offline benchmarks. Latency and failures are drawn from
+    # a generator seeded per request, so a run is reproducible request for request; the response
+    # text comes from responder(model, messages), or a digest of the request by default.
+    name = "stub"
+    cacheable = False
+
+    def __init__(self, latency=0.5, jitter=0.0, token_delay=0.0, error_rate=0.0, error_status=503,
+                 retry_after=None, seed=0, responder=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.seed = seed
+        self.responder = responder or self._default_response
+        self.calls = 0
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _default_response(model, messages):
+        digest = request_key(model, messages, None)[:12]
+        return f"Stub response {digest} to a {len(messages[-1]['content'])}-character prompt."
+
+    def _arrive(self, model, messages, temperature, timeout):
+        # Sleeps for the request's latency, then fails or returns its text. Each retry of the
+        # same request draws again, so injected errors are transient as with a real backend.
+        key = request_key(model, messages, temperature)
+        with self._lock:
+            self.calls += 1
+            attempt = self._attempts[key] = self._attempts.get(key, 0) + 1
+        rng = random.Random(f"{self.seed}:{key}:{attempt}")
+        delay = max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter))
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"stub backend took longer than {timeout}s")
+        time.sleep(delay)
+        if rng.random() < self.error_rate:
+            raise StubError(self.error_status, self.retry_after)
+        return self.responder(model, messages)
+
+    def complete(self, model, messages, temperature, timeout):
+        return self._arrive(model, messages, temperature, timeout)
+
+    def stream(self, model, messages, temperature, timeout):
+        return self._pieces(self._arrive(model, messages, temperature, timeout))
+
+    def _pieces(self, text):
+        for piece in _piece_re.findall(text):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield piece
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+class CassetteBackend:
+    # Record mode passes requests to inner and saves each response to a JSON cassette;
+    # replay mode answers only from the cassette, instantly, and fails on unrecorded requests.
+
+    def __init__(self, path, mode="replay", inner=None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if mode == "record" and inner is None:
+            raise ValueError("Recording needs a backend to record from")
+        self.path = path
+        self.mode = mode
+        self.inner = inner
+        self.name = f"cassette-{mode}"
+        # A replayed response is already a recording; recorded ones follow the real backend
+        self.cacheable = mode == "record" and inner.cacheable
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _replay(self, model, messages, temperature):
+        key = request_key(model, messages, temperature)
+        if key not in self._entries:
+            raise CassetteMiss(f"No recorded response for request {key[:12]} in {self.path}")
+        return self._entries[key]["response"]
+
+    def _record(self, model, messages, temperature, response):
+        key = request_key(model, messages, temperature)
+        with self._lock:
+            self._entries[key] = {"model": model, "temperature": temperature, "messages": messages, "response": response}
+            # Written whole through a temporary file, so an interrupted run leaves a valid cassette
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.path)
+
+    def complete(self, model, messages, temperature, timeout):
+        if self.mode == "replay":
+            return self._replay(model, messages, temperature)
+        response = self.inner.complete(model, messages, temperature, timeout)
+        self._record(model, messages, temperature, response)
+        return response
+
+    def stream(self, model, messages, temperature, timeout):
+        if self.mode == "replay":
+            return iter(_piece_re.findall(self._replay(model, messages, temperature)))
+        return self._recording(model, messages, temperature, self.inner.stream(model, messages, temperature, timeout))
+
+    def _recording(self, model, messages, temperature, pieces):
+        parts = []
+        for piece in pieces:
+            parts.append(piece)
+            yield piece
+        self._record(model, messages, temperature, "".join(parts))
+
+
+def backend_from_env(api_key=None):
+    # LLM_BACKEND: openai (default), stub, record or replay. Stub settings come from
+    # LLM_STUB_* variables; record and replay use the cassette at LLM_CASSETTE, recording
+    # from OpenAI unless LLM_RECORD_FROM=stub. api_key goes to any OpenAI backend built,
+    # which otherwise reads OPENAI_API_KEY.
+    kind = os.getenv("LLM_BACKEND", "openai").lower()
+
+    def stub():
+        return StubBackend(
+            latency=float(os.getenv("LLM_STUB_LATENCY", 0.5)),
+            jitter=float(os.getenv("LLM_STUB_JITTER", 0.0)),
+            token_delay=float(os.getenv("LLM_STUB_TOKEN_DELAY", 0.0)),
+            error_rate=float(os.getenv("LLM_STUB_ERROR_RATE", 0.0)),
+            error_status=int(os.getenv("LLM_STUB_ERROR_STATUS", 503)),
+            seed=int(os.getenv("LLM_STUB_SEED", 0)),
+        )
+
+    if kind == "openai":
+        return OpenAIBackend(api_key)
+    if kind == "stub":
+        return stub()
+    if kind in ("record", "replay"):
+        cassette = os.getenv("LLM_CASSETTE", os.path.join("cassettes", "llm.json"))
+        inner = None
+        if kind == "record":
+            inner = stub() if os.getenv("LLM_RECORD_FROM", "openai").lower() == "stub" else OpenAIBackend(api_key)
+        return CassetteBackend(cassette, mode=kind, inner=inner)
+    raise ValueError(f"Unknown LLM_BACKEND: {kind}")
@@ -1,25 +1,397 @@
 # llm_engine.py
 
-from openai import OpenAI
+import openai
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
 import os
+import random
+import threading
+import time
+import response_cache
+from llm_backends import backend_from_env
+from prompt_compactor import count_tokens
 
 # You could also move these to st.secrets or config later
 DEFAULT_MODEL = "gpt-4o"
 DEFAULT_TEMPERATURE = 0.3
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Concurrency and account rate limits for batches of calls
+DEFAULT_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 8))
+REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 500))
+TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 150000))
+# Completion tokens budgeted per call when charging the token bucket up front
+EXPECTED_COMPLETION_TOKENS = 500
 
-def call_chat_model(system_msg, user_prompt, model=DEFAULT_MODEL, temperature=DEFAULT_TEMPERATURE):
+# enabled: read and write the persistent response cache. Forced regeneration is per call
+# (refresh=True skips the read but still stores the new response), so one session's
+# choice never changes another's.
+cache_settings = {"enabled": True}
+
+# Per-attempt timeout, retries with exponential backoff and full jitter, and an optional
+# duplicate request sent when the first has been outstanding for hedge_after seconds (0 = off).
+# timeout and hedge_after are process defaults; a call can pass its own instead.
+retry_settings = {
+    "timeout": float(os.getenv("LLM_TIMEOUT", 60)),
+    "max_retries": int(os.getenv("LLM_MAX_RETRIES", 4)),
+    "backoff_base": float(os.getenv("LLM_BACKOFF_BASE", 1.0)),
+    "backoff_max": float(os.getenv("LLM_BACKOFF_MAX", 30.0)),
+    "hedge_after": float(os.getenv("LLM_HEDGE_AFTER", 0)),
+}
+# Consecutive backend failures that open the circuit, and how long it stays open
+CIRCUIT_FAILURES = int(os.getenv("LLM_CIRCUIT_FAILURES", 5))
+CIRCUIT_COOLDOWN = float(os.getenv("LLM_CIRCUIT_COOLDOWN", 30))
+
+llm_call_stats = {"requests": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0, "circuit_rejections": 0}
+
+# Where requests go: OpenAI by default, or a stub / cassette backend chosen by LLM_BACKEND
+# (see llm_backends). Swap it at runtime with set_backend or configure_backend.
+backend = backend_from_env()
+_backend_lock = threading.Lock()
+_configured_key = None
+
+
+def get_backend():
+    return backend
+
+
+def set_backend(new_backend):
+    global backend
+    previous, backend = backend, new_backend
+    return previous
+
+
+def configure_backend(api_key):
+    # Installs a new backend built with this OpenAI key. The key is never set on the current
+    # backend, whose client may already exist and be shared by calls in flight. The same key
+    # again keeps the current backend, so app reruns reuse its client.
+    global _configured_key
+    with _backend_lock:
+        if api_key != _configured_key:
+            set_backend(backend_from_env(api_key))
+            _configured_key = api_key
+        return backend
+
+
+def _use_cache():
+    return cache_settings["enabled"] and backend.cacheable
+
+
+class LLMError(Exception):
+    # Raised by call_chat_model and stream_chat_model once retries are exhausted, and returned
+    # in place of response text by call_chat_models, so failures never pass for content
+
+    RETRIABLE = ("timeout", "connection", "rate_limit", "server")
+    # Kinds that say the backend is unreachable or unhealthy, as opposed to a bad request
+    BACKEND_DOWN = ("timeout", "connection", "server")
+
+    def __init__(self, kind, message, status=None, retry_after=None, attempts=0):
+        super().__init__(message)
+        self.kind = kind
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+        self.attempts = attempts
+
+    @property
+    def retriable(self):
+        return self.kind in self.RETRIABLE
+
+    def as_dict(self):
+        return {"kind": self.kind, "message": self.message, "status": self.status, "attempts": self.attempts}
+
+    def __str__(self):
+        return f"{self.kind}: {self.message}"
+
+    @classmethod
+    def from_exception(cls, e, attempts=0):
+        if isinstance(e, LLMError):
+            e.attempts = attempts
+            return e
+        status = getattr(e, "status_code", None)
+        if isinstance(e, (openai.APITimeoutError, TimeoutError)):
+            kind = "timeout"
+        elif isinstance(e, (openai.APIConnectionError, ConnectionError)):
+            kind = "connection"
+        elif status == 429:
+            kind = "rate_limit"
+        elif status is not None and (status in (408, 409) or status >= 500):
+            kind = "server"
+        elif status is not None:
+            kind = "client"
+        else:
+            kind = "unknown"
+        return cls(kind, str(e), status, _retry_after(getattr(e, "response", None)), attempts)
+
+
+def _retry_after(response):
+    # Seconds the server asked us to wait, from retry-after-ms or retry-after (seconds or HTTP date)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    # Full jitter: uniform in [0, min(max, base * 2^attempt)], but never sooner than Retry-After
+    delay = random.uniform(0, min(retry_settings["backoff_max"], retry_settings["backoff_base"] * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class CircuitBreaker:
+    # Closed until `failures` backend errors in a row; then open, failing calls immediately,
+    # for `cooldown` seconds; then a single probe decides whether it closes again
+
+    def __init__(self, failures=CIRCUIT_FAILURES, cooldown=CIRCUIT_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive = 0
+        self.opened = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened >= self.cooldown else "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive = 0
+            self.opened = None
+            self.probing = False
+
+    def release_probe(self):
+        # The call said nothing about the backend's health (e.g. a 4xx), so neither closes nor
+        # reopens the circuit; a half-open circuit lets the next call probe instead
+        with self.lock:
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive += 1
+            if self.probing or self.consecutive >= self.failures:
+                self.opened = time.monotonic()
+            self.probing = False
+
+
+circuit_breaker = CircuitBreaker()
+
+# Runs hedged attempts; sized well above any batch concurrency so hedges never queue
+_hedge_pool = ThreadPoolExecutor(max_workers=128)
+
+
+def _send(system_msg, user_prompt, model, temperature, timeout, stream=False):
+    # An empty system_msg sends the user prompt on its own
+    llm_call_stats["requests"] += 1
+    messages = [{"role": "system", "content": system_msg}] if system_msg else []
+    messages.append({"role": "user", "content": user_prompt})
+    send = backend.stream if stream else backend.complete
+    return send(model, messages, temperature, timeout)
+
+
+def _hedged(send, limiter, tokens, hedge_after):
+    # The first answer wins; the loser is left to finish in the background and is ignored
+    if hedge_after <= 0:
+        return send()
+    primary = _hedge_pool.submit(send)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result()
+
+    if limiter is not None:
+        limiter.acquire(tokens)
+    llm_call_stats["hedges"] += 1
+    backup = _hedge_pool.submit(send)
+    pending = {primary, backup}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is backup:
+                    llm_call_stats["hedge_wins"] += 1
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def _with_retries(attempt, limiter, tokens):
+    # Calls attempt() until it succeeds, the error is not retriable, retries run out or the
+    # circuit is open. Raises LLMError.
+    max_retries = retry_settings["max_retries"]
+    for number in range(max_retries + 1):
+        if not circuit_breaker.allow():
+            llm_call_stats["circuit_rejections"] += 1
+            raise LLMError("circuit_open", "LLM backend is failing; requests are paused", attempts=number)
+        if limiter is not None:
+            limiter.acquire(tokens)
+        try:
+            result = attempt()
+        except Exception as e:
+            error = LLMError.from_exception(e, attempts=number + 1)
+            # Only backend errors count against the circuit, and only real answers close it
+            if error.kind in LLMError.BACKEND_DOWN:
+                circuit_breaker.record_failure()
+            else:
+                circuit_breaker.release_probe()
+            if not error.retriable or number == max_retries:
+                llm_call_stats["failures"] += 1
+                raise error
+            llm_call_stats["retries"] += 1
+            time.sleep(backoff_delay(number, error.retry_after))
+            continue
+        circuit_breaker.record_success()
+        return result
+
+
+def call_chat_model(system_msg, user_prompt, model=DEFAULT_MODEL, temperature=DEFAULT_TEMPERATURE, limiter=None,
+                    refresh=False, timeout=None, hedge_after=None):
+    # Response text; raises LLMError once retries are exhausted. timeout and hedge_after
+    # default to retry_settings
+    key = response_cache.response_key(model, temperature, system_msg, user_prompt)
+    if _use_cache() and not refresh:
+        cached = response_cache.load(key)
+        if cached is not None:
+            return cached
+
+    # Only real requests count against the rate limits
+    tokens = estimate_tokens(system_msg, user_prompt) + EXPECTED_COMPLETION_TOKENS
+
+    timeout = retry_settings["timeout"] if timeout is None else timeout
+    hedge_after = retry_settings["hedge_after"] if hedge_after is None else hedge_after
+
+    def attempt():
+        send = lambda: _send(system_msg, user_prompt, model, temperature, timeout)
+        return _hedged(send, limiter, tokens, hedge_after).strip()
+
+    content = _with_retries(attempt, limiter, tokens)
+
+    if _use_cache():
+        response_cache.store(key, content)
+    return content
+
+
+def stream_chat_model(system_msg, user_prompt, model=DEFAULT_MODEL, temperature=DEFAULT_TEMPERATURE, limiter=None,
+                      refresh=False, timeout=None):
+    # Same as call_chat_model, but yields the text as it arrives. A cached response is
+    # yielded in one piece; a fresh one is cached once the stream has finished. Opening the
+    # stream is retried; a failure after text has been yielded cannot be, and raises LLMError.
+    # Streams are never hedged.
+    key = response_cache.response_key(model, temperature, system_msg, user_prompt)
+    if _use_cache() and not refresh:
+        cached = response_cache.load(key)
+        if cached is not None:
+            yield cached
+            return
+
+    tokens = estimate_tokens(system_msg, user_prompt) + EXPECTED_COMPLETION_TOKENS
+    timeout = retry_settings["timeout"] if timeout is None else timeout
+    stream = _with_retries(
+        lambda: _send(system_msg, user_prompt, model, temperature, timeout, stream=True), limiter, tokens
+    )
+
+    parts = []
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_msg},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=temperature
-        )
-        return response.choices[0].message.content.strip()
+        for delta in stream:
+            # Leading whitespace is dropped, as call_chat_model's strip() would
+            if not parts:
+                delta = delta.lstrip()
+                if not delta:
+                    continue
+            parts.append(delta)
+            yield delta
     except Exception as e:
-        return f"Error: {e}"
+        error = LLMError.from_exception(e, attempts=1)
+        if error.kind in LLMError.BACKEND_DOWN:
+            circuit_breaker.record_failure()
+        llm_call_stats["failures"] += 1
+        raise error
+
+    if _use_cache():
+        response_cache.store(key, "".join(parts).strip())
+
+
+class TokenBucket:
+    # Refills continuously at per_minute / 60 per second, holding at most one minute's worth
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, amount=1):
+        # Blocks until amount is available; a request bigger than the bucket waits for a full one
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.level >= amount:
+                    self.level -= amount
+                    return
+                wait = (amount - self.level) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def acquire(self, tokens):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+
+# Shared by every batch in the process, since the limits are per account
+rate_limiter = RateLimiter()
+
+
+def estimate_tokens(*texts):
+    return sum(count_tokens(text) for text in texts) + 1
+
+
+def call_chat_models(calls, concurrency=DEFAULT_CONCURRENCY, limiter=None, refresh=False, timeout=None,
+                     hedge_after=None):
+    # calls: list of call_chat_model keyword dicts. Runs them on a thread pool under the
+    # request and token rate limits; results come back in the same order as calls. Unlike
+    # call_chat_model this does not raise: a failed call's LLMError is returned in its place,
+    # so one failure does not lose the rest of the batch.
+    limiter = limiter or rate_limiter
+
+    def run(call):
+        try:
+            return call_chat_model(limiter=limiter, refresh=refresh, timeout=timeout, hedge_after=hedge_after, **call)
+        except LLMError as e:
+            return e
+
+    if not calls:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(calls)))) as pool:
+        return list(pool.map(run, calls))
@@ -1,17 +1,15 @@
 import streamlit as st
-import pandas as pd
-import openai
 import graphviz
-import openpyxl
-import re
+import math
+from file_session import get_file_session
+from llm_engine import call_chat_model, configure_backend, get_backend, LLMError
 
-# Get OpenAI API Key from Streamlit Secrets
+# Get OpenAI API Key from Streamlit Secrets; stub and replay backends run without one
 openai_api_key = st.secrets.get("OPENAI_API_KEY")
 
-# Initialize OpenAI client
 if openai_api_key:
-    client = openai.OpenAI(api_key=openai_api_key)
-else:
+    configure_backend(openai_api_key)
+elif get_backend().name == "openai":
     st.error("⚠️ OpenAI API key is missing. Add it to Streamlit Secrets.")
     st.stop()
 
@@ -24,35 +22,29 @@ uploaded_file = st.file_uploader("Upload an Excel file", type=["xlsx", "xls"])
 if uploaded_file:
     st.success(f"✅ File '{uploaded_file.name}' uploaded successfully!")
     
-    # Read Excel file
-    df = pd.ExcelFile(uploaded_file)
-    sheet_names = df.sheet_names
+    # Read Excel file once per file content; reruns reuse the same session
+    session = get_file_session(uploaded_file)
+    sheet_names = session.sheet_names
     
-    # Generate AI responses for all sheets on upload
-    if 'ai_responses' not in st.session_state or st.button("🔄 Refresh AI Responses"):
+    # Generate AI responses for all sheets on upload; a refresh asks again instead of
+    # answering from the response cache
+    refresh = st.button("🔄 Refresh AI Responses")
+    if 'ai_responses' not in st.session_state or refresh:
         st.session_state.ai_responses = {}
         for sheet in sheet_names:
-            sheet_data = df.parse(sheet)
-            sample_data = sheet_data.head().to_dict()
+            sample_data = session.sample(sheet)
             prompt = f"Analyze this Excel sheet and describe its structure, column meanings, and any insights:\n{sample_data}"
             formula_prompt = f"Generate a Python script using pandas that replicates the formulas in the following Excel sheet:\n{sample_data}\nInclude any necessary calculations that reflect Excel formulas."
             
+            # No system message, at the API's default temperature
             try:
-                response = client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                ai_summary = response.choices[0].message.content
-            except Exception as e:
+                ai_summary = call_chat_model("", prompt, model="gpt-4", temperature=1.0, refresh=refresh)
+            except LLMError as e:
                 ai_summary = f"⚠️ OpenAI API Error: {e}"
-            
+
             try:
-                formula_response = client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[{"role": "user", "content": formula_prompt}]
-                )
-                generated_code = formula_response.choices[0].message.content
-            except Exception as e:
+                generated_code = call_chat_model("", formula_prompt, model="gpt-4", temperature=1.0, refresh=refresh)
+            except LLMError as e:
                 generated_code = f"⚠️ OpenAI API Error: {e}"
             
             st.session_state.ai_responses[sheet] = {
@@ -62,37 +54,23 @@ if uploaded_file:
     
     # Let user select a sheet
     selected_sheet = st.selectbox("Select a sheet", sheet_names)
-    sheet_data = df.parse(selected_sheet)
     
-    # Show preview
+    # Show preview, one page of rows at a time
     st.write(f"### Preview of {selected_sheet}")
-    st.dataframe(sheet_data.head())
-    
-    # Toggle button for full sheet preview
-    show_full = st.checkbox("Show Full Sheet")
-    if show_full:
-        st.dataframe(sheet_data)
+    total_rows = session.row_count(selected_sheet)
+    page_cols = st.columns(2)
+    page_size = page_cols[0].selectbox("Rows per page", [5, 25, 100, 500, 1000], index=0)
+    page_count = max((total_rows + page_size - 1) // page_size, 1)
+    page_number = page_cols[1].number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1)
+    st.dataframe(session.page(selected_sheet, (page_number - 1) * page_size, page_size))
+    st.caption(f"{total_rows:,} rows in {selected_sheet}")
     
     # Generate Flow Diagram of Sheets
     st.write("### 🔄 Spreadsheet Flow Diagram")
     flow = graphviz.Digraph()
     
-    # Detect formula-based relationships
-    wb = openpyxl.load_workbook(uploaded_file, data_only=False)
-    sheet_links = {}
-    
-    for sheet in sheet_names:
-        ws = wb[sheet]
-        sheet_links[sheet] = set()
-        for row in ws.iter_rows():
-            for cell in row:
-                if isinstance(cell.value, str) and cell.value.startswith("="):
-                    # Detect direct sheet references (e.g., =Sheet2!A1)
-                    for ref_sheet in sheet_names:
-                        if re.search(rf'\b{ref_sheet}!', cell.value, re.IGNORECASE):
-                            if ref_sheet not in sheet_links:
-                                sheet_links[ref_sheet] = set()
-                            sheet_links[ref_sheet].add(sheet)
+    # Detect formula-based relationships: sheet -> sheets it references, weighted by reference count
+    sheet_edges = session.sheet_flow()
     
     # Generate the flow diagram
     for sheet in sheet_names:
@@ -101,9 +79,8 @@ if uploaded_file:
         else:
             flow.node(sheet)
     
-    for sheet, links in sheet_links.items():
-        for linked_sheet in links:
-            flow.edge(linked_sheet, sheet)
+    for (sheet, ref_sheet), count in sorted(sheet_edges.items()):
+        flow.edge(sheet, ref_sheet, label=str(count), penwidth=str(min(1 + math.log10(count), 5)))
     
     st.graphviz_chart(flow)
     
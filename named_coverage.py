@@ -0,0 +1,113 @@
+# named_coverage.py
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from heapq import heappop, heappush
+from itertools import chain
+from formula_tokenizer import iter_refs, area_bounds
+from formula_classes import CONSTANT, merge_rects, swept_areas
+from formula_mapper import range_address
+
+
+def formula_references(formula, file_name, sheet_name):
+    # (file, sheet, rect) for every same-workbook reference in one cell formula
+    for token in iter_refs(formula):
+        if not token.book:
+            yield file_name, token.sheet or sheet_name, area_bounds(token.area)
+
+
+def class_references(formula_class, file_name, sheet_name):
+    # Same, for a formula class: each relative reference widened over the class's copies
+    if formula_class.canonical == CONSTANT:
+        return
+    for token in iter_refs(formula_class.formula):
+        if not token.book:
+            for swept in swept_areas(token.area, formula_class.anchor, formula_class.rects):
+                yield file_name, token.sheet or sheet_name, swept
+
+
+def cell_count(rects):
+    return sum((bottom - top + 1) * (right - left + 1) for top, left, bottom, right in rects)
+
+
+def coverage_report(references, named_index):
+    # references: iterable of (file, sheet, rect, referenced_by).
+    # Returns {file: {"coverage", "references", "uncovered_references", "referenced_cells",
+    #                 "uncovered_cells", "sheets": {sheet: {... "regions", "region_referenced_by",
+    #                 "referenced_by"}}}}, where region_referenced_by lines up with regions
+    referenced = defaultdict(list)
+    uncovered = defaultdict(list)
+    uncovered_by = defaultdict(list)
+    counts = Counter()
+    uncovered_counts = Counter()
+    referenced_by = defaultdict(set)
+
+    for file_name, sheet_name, rect, by in references:
+        key = (file_name, sheet_name)
+        referenced[key].append(rect)
+        counts[key] += 1
+        _, leftovers = named_index.cover(file_name, sheet_name, *rect)
+        if leftovers:
+            uncovered[key].extend(leftovers)
+            uncovered_by[key].extend((leftover, by) for leftover in leftovers)
+            uncovered_counts[key] += 1
+            referenced_by[key].add(by)
+
+    report = {}
+    for (file_name, sheet_name), rects in sorted(referenced.items()):
+        regions = merge_rects(uncovered[(file_name, sheet_name)])
+        sheet_report = {
+            "references": counts[(file_name, sheet_name)],
+            "uncovered_references": uncovered_counts[(file_name, sheet_name)],
+            "referenced_cells": cell_count(merge_rects(rects)),
+            "uncovered_cells": cell_count(regions),
+            "regions": regions,
+            "region_referenced_by": _names_per_region(regions, uncovered_by[(file_name, sheet_name)]),
+            "referenced_by": sorted(referenced_by[(file_name, sheet_name)])
+        }
+        workbook = report.setdefault(file_name, {
+            "references": 0, "uncovered_references": 0, "referenced_cells": 0, "uncovered_cells": 0, "sheets": {}
+        })
+        workbook["sheets"][sheet_name] = sheet_report
+        for field in ("references", "uncovered_references", "referenced_cells", "uncovered_cells"):
+            workbook[field] += sheet_report[field]
+
+    for workbook in report.values():
+        total = workbook["referenced_cells"]
+        workbook["coverage"] = 1 - workbook["uncovered_cells"] / total if total else 1.0
+    return report
+
+
+def _names_per_region(regions, leftovers):
+    # For each merged region, the names whose uncovered rectangles overlap it. Leftovers are
+    # taken in top-row order against a heap of the regions still open at that row (regions
+    # come sorted by top), so each leftover only checks regions whose rows overlap its own.
+    tops = [region[0] for region in regions]
+    names = [set() for _ in regions]
+    open_regions = []
+    next_region = 0
+    for (top, left, bottom, right), by in sorted(leftovers, key=lambda leftover: leftover[0][0]):
+        while next_region < len(regions) and tops[next_region] <= top:
+            heappush(open_regions, (regions[next_region][2], next_region))
+            next_region += 1
+        while open_regions and open_regions[0][0] < top:
+            heappop(open_regions)
+        starting = range(next_region, bisect_right(tops, bottom))
+        for i in chain((i for _, i in open_regions), starting):
+            _, r_left, _, r_right = regions[i]
+            if r_left <= right and r_right >= left:
+                names[i].add(by)
+    return [sorted(found) for found in names]
+
+
+def region_rows(workbook_report):
+    # One table row per merged uncovered rectangle, for st.dataframe
+    rows = []
+    for sheet_name, sheet_report in workbook_report["sheets"].items():
+        for rect, names in zip(sheet_report["regions"], sheet_report["region_referenced_by"]):
+            rows.append({
+                "Sheet": sheet_name,
+                "Region": range_address(*rect),
+                "Cells": cell_count([rect]),
+                "Referenced by": ", ".join(names)
+            })
+    return rows
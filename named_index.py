@@ -0,0 +1,149 @@
+# named_index.py
+import hashlib
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+
+class NamedRangeIndex:
+    # Named ranges kept as rectangles per (file, sheet) instead of one dict entry per cell.
+    # Rows are cut into bands at every rectangle edge; each band lists the rectangles
+    # crossing it ordered by first column, so a point lookup is two bisects.
+    # When rectangles overlap the most recently added one wins, like the old per-cell dict.
+
+    def __init__(self):
+        self._rects = defaultdict(list)
+        self._bands = {}
+        self._order = 0
+        self._version = None
+
+    def add(self, file_name, sheet_name, name, min_row, min_col, max_row, max_col):
+        self._order += 1
+        self._rects[(file_name, sheet_name)].append((min_row, min_col, max_row, max_col, name, self._order))
+        self._bands.pop((file_name, sheet_name), None)
+        self._version = None
+
+    def __len__(self):
+        return sum(len(rects) for rects in self._rects.values())
+
+    def __contains__(self, key):
+        return self.lookup(*key) is not None
+
+    def __getstate__(self):
+        return {"_rects": dict(self._rects), "_order": self._order}
+
+    def __setstate__(self, state):
+        self._rects = defaultdict(list, state["_rects"])
+        self._bands = {}
+        self._order = state["_order"]
+        self._version = None
+
+    @property
+    def version(self):
+        # Fingerprint of the contents, so an identical index rebuilt on a rerun keeps its version
+        if self._version is None:
+            digest = hashlib.sha256()
+            for key in sorted(self._rects):
+                digest.update(repr((key, self._rects[key])).encode())
+            self._version = digest.hexdigest()
+        return self._version
+
+    def sheets(self):
+        return list(self._rects)
+
+    def rects(self, file_name, sheet_name):
+        return [(name, (min_row, min_col, max_row, max_col)) for min_row, min_col, max_row, max_col, name, _ in self._rects.get((file_name, sheet_name), [])]
+
+    def _sheet_bands(self, key):
+        bands = self._bands.get(key)
+        if bands is not None:
+            return bands
+
+        rects = self._rects.get(key, [])
+        edges = sorted({r[0] for r in rects} | {r[2] + 1 for r in rects})
+        members = [[] for _ in edges]
+        for rect in rects:
+            for i in range(bisect_left(edges, rect[0]), bisect_left(edges, rect[2] + 1)):
+                members[i].append(rect)
+        for band in members:
+            band.sort(key=lambda rect: rect[1])
+        bands = self._bands[key] = (edges, members, [[rect[1] for rect in band] for band in members])
+        return bands
+
+    def lookup(self, file_name, sheet_name, row, col):
+        key = (file_name, sheet_name)
+        if key not in self._rects:
+            return None
+        edges, members, starts = self._sheet_bands(key)
+        i = bisect_right(edges, row) - 1
+        if i < 0:
+            return None
+
+        best = None
+        band = members[i]
+        for j in range(bisect_right(starts[i], col) - 1, -1, -1):
+            rect = band[j]
+            if rect[3] >= col and (best is None or rect[5] > best[5]):
+                best = rect
+        if best is None:
+            return None
+        min_row, min_col, _, _, name, _ = best
+        return name, row - min_row + 1, col - min_col + 1
+
+    def overlapping(self, file_name, sheet_name, min_row, min_col, max_row, max_col):
+        key = (file_name, sheet_name)
+        if key not in self._rects:
+            return []
+        edges, members, _ = self._sheet_bands(key)
+        found = {}
+        first = max(bisect_right(edges, min_row) - 1, 0)
+        last = bisect_right(edges, max_row)
+        for band in members[first:last]:
+            for rect in band:
+                if rect[1] > max_col:
+                    break
+                if rect[3] >= min_col and rect[0] <= max_row and rect[2] >= min_row:
+                    found[rect[5]] = rect
+        return [found[order] for order in sorted(found, reverse=True)]
+
+    def cover(self, file_name, sheet_name, min_row, min_col, max_row, max_col):
+        # Splits a rectangle into the named pieces that cover it and the uncovered
+        # leftovers: ([(name, (r_off_from, r_off_to), (c_off_from, c_off_to))], [rect, ...])
+        pieces = []
+        remaining = [(min_row, min_col, max_row, max_col)]
+        for top, left, bottom, right, name, _ in self.overlapping(file_name, sheet_name, min_row, min_col, max_row, max_col):
+            still_open = []
+            for part in remaining:
+                inter = (max(part[0], top), max(part[1], left), min(part[2], bottom), min(part[3], right))
+                if inter[0] > inter[2] or inter[1] > inter[3]:
+                    still_open.append(part)
+                    continue
+                pieces.append((
+                    name,
+                    (inter[0] - top + 1, inter[2] - top + 1),
+                    (inter[1] - left + 1, inter[3] - left + 1)
+                ))
+                still_open.extend(subtract(part, inter))
+            remaining = still_open
+            if not remaining:
+                break
+        return pieces, remaining
+
+    def get(self, key, default=None):
+        hit = self.lookup(*key)
+        return default if hit is None else hit
+
+
+def subtract(rect, hole):
+    # rect minus a hole lying inside it, as up to four disjoint rectangles
+    min_row, min_col, max_row, max_col = rect
+    h_min_row, h_min_col, h_max_row, h_max_col = hole
+    parts = []
+    if min_row < h_min_row:
+        parts.append((min_row, min_col, h_min_row - 1, max_col))
+    if h_max_row < max_row:
+        parts.append((h_max_row + 1, min_col, max_row, max_col))
+    if min_col < h_min_col:
+        parts.append((h_min_row, min_col, h_max_row, h_min_col - 1))
+    if h_max_col < max_col:
+        parts.append((h_min_row, h_max_col + 1, h_max_row, max_col))
+    return parts
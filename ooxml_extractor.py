@@ -0,0 +1,356 @@
+# ooxml_extractor.py
+import codecs
+import html
+import posixpath
+import re
+import zipfile
+from collections import defaultdict
+from io import BytesIO
+from xml.etree.ElementTree import iterparse
+from openpyxl.formula.translate import Translator
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+from openpyxl.utils.cell import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_ISO8601, from_excel
+
+_ref_re = re.compile(r"^\$?([A-Z]{1,3})\$?([0-9]+)$")
+_area_re = re.compile(r"^(?:'((?:[^']|'')+)'|([^'!]+))!(\$?[A-Z]{1,3}\$?[0-9]+(?::\$?[A-Z]{1,3}\$?[0-9]+)?)$")
+_col_cache = {}
+
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _split_ref(ref):
+    m = _ref_re.match(ref)
+    col_str, row_str = m.groups()
+    col = _col_cache.get(col_str)
+    if col is None:
+        col = _col_cache[col_str] = column_index_from_string(col_str)
+    return int(row_str), col
+
+
+def _rect(ref):
+    start, _, end = ref.partition(":")
+    min_row, min_col = _split_ref(start)
+    max_row, max_col = _split_ref(end) if end else (min_row, min_col)
+    return min_row, min_col, max_row, max_col
+
+
+def _cast_number(text):
+    if "." in text or "E" in text or "e" in text:
+        return float(text)
+    return int(text)
+
+
+def _split_areas(text):
+    areas, current, quoted = [], [], False
+    for ch in text:
+        if ch == "'":
+            quoted = not quoted
+        if ch == "," and not quoted:
+            areas.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+    areas.append("".join(current))
+    return areas
+
+
+def parse_destinations(text):
+    # Mirrors openpyxl's DefinedName.destinations: plain sheet!range areas only
+    destinations = []
+    if not text or text.startswith("[") or "#REF!" in text:
+        return destinations
+    for area in _split_areas(text.strip()):
+        m = _area_re.match(area.strip())
+        if not m:
+            continue
+        sheet_name = m.group(1).replace("''", "'") if m.group(1) else m.group(2)
+        destinations.append((sheet_name, _rect(m.group(3))))
+    return destinations
+
+
+def _read_rels(zf, path):
+    rels = {}
+    if path not in zf.namelist():
+        return rels
+    base = posixpath.dirname(posixpath.dirname(path))
+    for _, elem in iterparse(zf.open(path)):
+        if _local(elem.tag) == "Relationship":
+            target = elem.get("Target")
+            if target.startswith("/"):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(base, target))
+            rels[elem.get("Id")] = target
+    return rels
+
+
+def read_workbook_parts(zf):
+    sheets = []
+    defined_names = []
+    epoch = CALENDAR_WINDOWS_1900
+    for _, elem in iterparse(zf.open("xl/workbook.xml")):
+        tag = _local(elem.tag)
+        if tag == "workbookPr":
+            if elem.get("date1904") in ("1", "true"):
+                epoch = CALENDAR_MAC_1904
+        elif tag == "sheet":
+            rid = next(v for k, v in elem.attrib.items() if _local(k) == "id")
+            sheets.append((elem.get("name"), rid))
+        elif tag == "definedName":
+            # Sheet-scoped and reserved names are not workbook names in openpyxl either
+            if elem.get("localSheetId") is None and not elem.get("name", "").startswith("_xlnm."):
+                defined_names.append((elem.get("name"), elem.text or ""))
+    rels = _read_rels(zf, "xl/_rels/workbook.xml.rels")
+    sheet_paths = {name: rels[rid] for name, rid in sheets if rid in rels}
+    return sheet_paths, defined_names, epoch
+
+
+def read_shared_strings(zf):
+    strings = []
+    if "xl/sharedStrings.xml" not in zf.namelist():
+        return strings
+    for _, elem in iterparse(zf.open("xl/sharedStrings.xml")):
+        if _local(elem.tag) == "si":
+            parts = []
+            for child in elem:
+                ctag = _local(child.tag)
+                if ctag == "t":
+                    parts.append(child.text or "")
+                elif ctag == "r":
+                    parts.extend(t.text or "" for t in child if _local(t.tag) == "t")
+            strings.append("".join(parts))
+            elem.clear()
+    return strings
+
+
+def read_date_styles(zf):
+    # {cell style index: is a duration} for every cellXfs style whose number format shows a
+    # date or a duration, indexed as openpyxl does, so numbers in them can become datetimes
+    date_styles = {}
+    if "xl/styles.xml" not in zf.namelist():
+        return date_styles
+    custom = {}
+    in_cell_xfs = False
+    index = 0
+    for event, elem in iterparse(zf.open("xl/styles.xml"), events=("start", "end")):
+        tag = _local(elem.tag)
+        if tag == "cellXfs":
+            in_cell_xfs = event == "start"
+        elif event != "end":
+            continue
+        elif tag == "numFmt":
+            custom[int(elem.get("numFmtId"))] = elem.get("formatCode")
+        elif tag == "xf" and in_cell_xfs:
+            num_fmt_id = int(elem.get("numFmtId", 0))
+            fmt = custom[num_fmt_id] if num_fmt_id in custom else builtin_format_code(num_fmt_id)
+            if fmt and is_date_format(fmt):
+                date_styles[index] = is_timedelta_format(fmt)
+            index += 1
+    return date_styles
+
+
+def _cell_value(cell_type, text, shared_strings, date_style=None, epoch=CALENDAR_WINDOWS_1900):
+    # date_style: None for an ordinary number format, else whether the date format is a duration
+    if text is None:
+        return None
+    if cell_type == "s":
+        return shared_strings[int(text)]
+    if cell_type == "b":
+        return text == "1"
+    if cell_type in ("str", "e"):
+        return text
+    if cell_type == "d":
+        # ISO 8601 date cells, parsed as openpyxl parses them
+        try:
+            return from_ISO8601(text)
+        except ValueError:
+            return text
+    if cell_type in (None, "n"):
+        number = _cast_number(text)
+        if date_style is None:
+            return number
+        # Dates are mostly serial numbers in a date format; openpyxl turns serials it cannot
+        # convert into #VALUE!
+        try:
+            return from_excel(number, epoch, timedelta=date_style)
+        except (OverflowError, ValueError):
+            return "#VALUE!"
+    # Types this reader does not know are kept as text rather than guessed at
+    return text
+
+
+_row_re = re.compile(r"<(?:\w+:)?row\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?row>)", re.S)
+# attrs, <f> attrs, <f> text, <v> text, anything else (inline strings etc.)
+_cell_re = re.compile(
+    r"<(?:\w+:)?c\b([^>]*?)(?:/>|>"
+    r"(?:<(?:\w+:)?f\b([^>]*?)(?:/>|>([^<]*)</(?:\w+:)?f>))?"
+    r"(?:<(?:\w+:)?v>([^<]*)</(?:\w+:)?v>)?"
+    r"(.*?)</(?:\w+:)?c>)",
+    re.S
+)
+_r_attr_re = re.compile(r"""\br=["']([^"']+)["']""")
+_t_attr_re = re.compile(r"""\bt=["']([^"']+)["']""")
+_s_attr_re = re.compile(r"""\bs=["']([0-9]+)["']""")
+_formula_re = re.compile(r"<(?:\w+:)?f\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?f>)", re.S)
+_value_re = re.compile(r"<(?:\w+:)?v>(.*?)</(?:\w+:)?v>", re.S)
+_text_re = re.compile(r"<(?:\w+:)?t\b[^>]*>(.*?)</(?:\w+:)?t>", re.S)
+_attr_re = re.compile(r"""([\w:]+)=(?:"([^"]*)"|'([^']*)')""")
+
+
+def _attrs(text):
+    return {k: a if a or not b else b for k, a, b in _attr_re.findall(text)} if text else {}
+
+
+def _xml_text(text):
+    return html.unescape(text) if "&" in text else text
+
+
+def _row_chunks(source, chunk_size):
+    # Decompressed sheet XML in pieces that end on a row boundary
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    while True:
+        chunk = source.read(chunk_size)
+        buffer += decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            yield buffer
+            return
+        cut = buffer.rfind("row>")
+        while cut > 0 and buffer[cut - 1] not in "/:":
+            cut = buffer.rfind("row>", 0, cut)
+        if cut > 0:
+            yield buffer[:cut + 4]
+            buffer = buffer[cut + 4:]
+
+
+def iter_sheet_cells(source, shared_strings, keep=None, keep_row=None, chunk_size=1 << 22, date_styles=None,
+                     epoch=CALENDAR_WINDOWS_1900):
+    # Yields (row, col, value) with formulas as "=..." text. Shared formulas are
+    # translated from their anchor and array formulas are given to every cell
+    # they cover. keep_row(row) / keep(row, col) limit which cells are yielded;
+    # numbers in date_styles (see read_date_styles) are yielded as datetimes.
+    # The sheet XML is scanned with compiled patterns rather than an XML parser,
+    # and rows outside keep_row are only looked at for shared/array anchors.
+    shared = {}
+    # row -> [(min_col, max_col, formula)] for every array formula covering that row,
+    # filled in when the array's anchor cell is read
+    array_rows = defaultdict(list)
+    row_num = 0
+
+    for text in _row_chunks(source, chunk_size):
+        for row_match in _row_re.finditer(text):
+            r_attr = _attrs(row_match.group(1)).get("r")
+            row_num = int(r_attr) if r_attr else row_num + 1
+            body = row_match.group(2)
+            if not body:
+                continue
+            row_wanted = keep_row is None or keep_row(row_num)
+            if not row_wanted and "<f" not in body and ":f" not in body:
+                continue
+
+            col_num = 0
+            for attr_text, f_attr_text, ftext, vtext, rest in _cell_re.findall(body):
+                ref = _r_attr_re.search(attr_text)
+                if ref:
+                    r, c = _split_ref(ref.group(1))
+                else:
+                    r, c = row_num, col_num + 1
+                col_num = c
+                wanted = row_wanted and (keep is None or keep(r, c))
+
+                formula = None
+                if not f_attr_text and not ftext and rest and "f" in rest:
+                    f_match = _formula_re.search(rest)
+                    if f_match:
+                        f_attr_text, ftext = f_match.group(1) or " ", f_match.group(2) or ""
+                if f_attr_text or ftext:
+                    ftext = _xml_text(ftext)
+                    f_attrs = _attrs(f_attr_text)
+                    ftype = f_attrs.get("t")
+                    if ftype == "shared":
+                        si = f_attrs.get("si")
+                        if ftext:
+                            formula = "=" + ftext
+                            shared[si] = Translator(formula, origin=f"{get_column_letter(c)}{r}")
+                        elif wanted and si in shared:
+                            formula = shared[si].translate_formula(f"{get_column_letter(c)}{r}")
+                    elif ftype == "array":
+                        if ftext:
+                            formula = "=" + ftext
+                            min_row, min_col, max_row, max_col = _rect(f_attrs.get("ref") or f"{get_column_letter(c)}{r}")
+                            for array_row in range(min_row, max_row + 1):
+                                array_rows[array_row].append((min_col, max_col, formula))
+                    elif ftext:
+                        formula = "=" + ftext
+
+                if not wanted:
+                    continue
+                if formula is None and r in array_rows:
+                    for min_col, max_col, array_formula in array_rows[r]:
+                        if min_col <= c <= max_col:
+                            formula = array_formula
+                            break
+                if formula is not None:
+                    yield r, c, formula
+                    continue
+
+                cell_type = _t_attr_re.search(attr_text)
+                cell_type = cell_type.group(1) if cell_type else None
+                if cell_type == "inlineStr":
+                    value = _xml_text("".join(_text_re.findall(rest)))
+                else:
+                    if not vtext and rest:
+                        v_match = _value_re.search(rest)
+                        vtext = v_match.group(1) if v_match else vtext
+                    date_style = None
+                    if date_styles and cell_type in (None, "n"):
+                        style = _s_attr_re.search(attr_text)
+                        date_style = date_styles.get(int(style.group(1))) if style else None
+                    value = _cell_value(cell_type, _xml_text(vtext) if vtext else None, shared_strings, date_style, epoch)
+                if value is not None:
+                    yield r, c, value
+
+
+def extract_named_ranges(file_bytes):
+    # Same shape as file_handlers._read_named_ranges, straight from the package XML
+    with zipfile.ZipFile(BytesIO(file_bytes)) as zf:
+        sheet_paths, defined_names, epoch = read_workbook_parts(zf)
+        shared_strings = read_shared_strings(zf)
+        date_styles = read_date_styles(zf)
+
+        rects_by_sheet = defaultdict(list)
+        for name, text in defined_names:
+            for sheet_name, rect in parse_destinations(text):
+                rects_by_sheet[sheet_name].append((name, rect))
+
+        named_ranges = []
+        for sheet_name, named_rects in rects_by_sheet.items():
+            path = sheet_paths.get(sheet_name)
+            if path is None or path not in zf.namelist():
+                continue
+
+            rows_in_use = set()
+            for _, (min_row, min_col, max_row, max_col) in named_rects:
+                rows_in_use.update(range(min_row, max_row + 1))
+            left = min(rect[1] for _, rect in named_rects)
+            right = max(rect[3] for _, rect in named_rects)
+
+            def keep(r, c):
+                return left <= c <= right
+
+            cells = iter_sheet_cells(
+                zf.open(path), shared_strings, keep, rows_in_use.__contains__, date_styles=date_styles, epoch=epoch
+            )
+            values = {(r, c): v for r, c, v in cells}
+
+            for name, (min_row, min_col, max_row, max_col) in named_rects:
+                rows = [
+                    [(r, c, values.get((r, c))) for c in range(min_col, max_col + 1)]
+                    for r in range(min_row, max_row + 1)
+                ]
+                named_ranges.append((name, sheet_name, min_row, min_col, rows))
+    return named_ranges
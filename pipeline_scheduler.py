@@ -0,0 +1,124 @@
+# pipeline_scheduler.py
+import queue
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_engine import DEFAULT_CONCURRENCY
+
+
+class Stage:
+
+    def __init__(self, name, rows, run, after=()):
+        self.name = name
+        # rows: list of row inputs, or callable(results) -> list, called once `after` is done
+        self.rows = rows
+        # run(row, results, emit) -> value; emit(piece) forwards partial output to the caller
+        self.run = run
+        self.after = tuple(after)
+
+
+class StageScheduler:
+    # Runs a DAG of stages on one thread pool. Every row of a stage is submitted as soon as
+    # the stages it depends on have finished, so independent stages share the pool instead
+    # of waiting on each other. Worker threads never touch the caller's UI: partial output
+    # and completions are queued and handed to on_event on the thread that called run().
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY):
+        self.concurrency = concurrency
+        self.stages = OrderedDict()
+        # stage -> {"rows", "started", "finished", "busy"}, times in seconds from the start of run()
+        self.timings = OrderedDict()
+
+    def add(self, name, rows, run, after=()):
+        # Dependencies must already be added, which keeps the graph acyclic
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already added")
+        for dep in after:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self.stages[name] = Stage(name, rows, run, after)
+
+    def run(self, on_event=None):
+        # on_event(kind, stage, index, value): kind is "piece" (partial output of row index),
+        # "row" (row index finished with value) or "stage" (whole stage finished, value is its
+        # list of row values). A row whose run raises finishes with the exception as its value,
+        # and the other rows and stages carry on. Returns {stage: [row values in row order]}.
+        on_event = on_event or (lambda *args: None)
+        events = queue.Queue()
+        results = {}
+        values = {}
+        remaining = {}
+        busy = {}
+        waiting = OrderedDict((name, set(stage.after)) for name, stage in self.stages.items())
+        start = time.perf_counter()
+        self.timings.clear()
+
+        def task(stage, index, row):
+            began = time.perf_counter()
+            try:
+                value = stage.run(row, results, lambda piece: events.put(("piece", stage.name, index, piece)))
+            except Exception as e:
+                value = e
+            events.put(("row", stage.name, index, (value, time.perf_counter() - began)))
+
+        def finish(name):
+            results[name] = values.pop(name)
+            self.timings[name]["finished"] = time.perf_counter() - start
+            self.timings[name]["busy"] = busy.pop(name)
+            for deps in waiting.values():
+                deps.discard(name)
+            on_event("stage", name, None, results[name])
+
+        pool = ThreadPoolExecutor(max_workers=max(1, self.concurrency))
+        try:
+            while len(results) < len(self.stages):
+                # Release every stage whose inputs are complete; empty stages finish on the spot
+                ready = [name for name, deps in waiting.items() if not deps]
+                for name in ready:
+                    del waiting[name]
+                    stage = self.stages[name]
+                    rows = stage.rows(results) if callable(stage.rows) else list(stage.rows)
+                    values[name] = [None] * len(rows)
+                    remaining[name] = len(rows)
+                    busy[name] = 0.0
+                    self.timings[name] = {"rows": len(rows), "started": time.perf_counter() - start}
+                    if not rows:
+                        finish(name)
+                        continue
+                    for index, row in enumerate(rows):
+                        pool.submit(task, stage, index, row)
+                if ready:
+                    continue
+
+                kind, name, index, value = events.get()
+                if kind == "piece":
+                    on_event("piece", name, index, value)
+                    continue
+                value, elapsed = value
+                values[name][index] = value
+                busy[name] += elapsed
+                remaining[name] -= 1
+                on_event("row", name, index, value)
+                if remaining[name] == 0:
+                    finish(name)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+        return results
+
+    def timing_report(self):
+        # One row per stage: wall time from release to last row, and summed row time, whose
+        # ratio shows how much the stage's rows overlapped
+        rows = []
+        for name, timing in self.timings.items():
+            if "finished" not in timing:
+                continue
+            rows.append({
+                "Stage": name,
+                "Rows": timing["rows"],
+                "Started (s)": round(timing["started"], 2),
+                "Finished (s)": round(timing["finished"], 2),
+                "Wall (s)": round(timing["finished"] - timing["started"], 2),
+                "Row time (s)": round(timing["busy"], 2),
+            })
+        return rows
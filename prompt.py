@@ -1,11 +1,9 @@
 # prompt.py
+from prompt_compactor import PROMPT_FORMULA_TOKENS, compact_formulas
 
-def build_json_summary_prompt(named_range, formulas):
+
+def _summary_object(named_range):
     return (
-        "You are an expert actuary and spreadsheet analyst.\n\n"
-        "Given the following remapped formulas from an Excel named range, summarize the pattern behind the calculations in a general form.\n"
-        "Each formula follows a remapped structure using notation like [1][2] to indicate row and column indices.\n\n"
-        "Please return a JSON object like:\n"
         "{\n"
         '  "file_name": "MyWorkbook.xlsx",\n'
         '  "sheet_name": "Inputs",\n'
@@ -15,12 +13,55 @@ def build_json_summary_prompt(named_range, formulas):
         '  "general_formula": "for i in range(...): for j in range(...): Result[i][j] = ...",\n'
         '  "dependencies": ["OtherNamedRange1", "OtherNamedRange2"],\n'
         '  "notes": "Any caveats, limitations, or variations found"\n'
-        "}\n\n"
-        f"Formulas:\n{formulas[:10]}  # Sample first 10 for context\n\n"
+        "}"
+    )
+
+
+def _compacted(named_range, formulas, boundary, budget, report):
+    # report, when given, collects {named range: (full tokens, compacted tokens)} for the caller
+    text, counts = compact_formulas(formulas, boundary, budget)
+    if report is not None:
+        report[named_range] = counts
+    return text
+
+
+def build_json_summary_prompt(named_range, formulas, boundary=(), budget=PROMPT_FORMULA_TOKENS, report=None):
+    return (
+        "You are an expert actuary and spreadsheet analyst.\n\n"
+        "Given the following remapped formulas from an Excel named range, summarize the pattern behind the calculations in a general form.\n"
+        "Each formula follows a remapped structure using notation like [1][2] to indicate row and column indices.\n\n"
+        "Please return a JSON object like:\n"
+        f"{_summary_object(named_range)}\n\n"
+        "Formulas (one per distinct pattern, then the range's corner cells):\n"
+        f"{_compacted(named_range, formulas, boundary, budget, report)}\n\n"
         "Only return the JSON."
     )
 
 
+def build_batch_section(named_range, formulas, boundary=(), budget=PROMPT_FORMULA_TOKENS, report=None):
+    # One range's part of a batch prompt; also what a range adds to a batch when packing
+    return f"Named range: {named_range}\nFormulas:\n{_compacted(named_range, formulas, boundary, budget, report)}"
+
+
+def build_batch_summary_prompt(named_ranges, boundaries=None, budget=PROMPT_FORMULA_TOKENS, report=None):
+    # named_ranges: {name: formulas}; several small ranges answered in one JSON array
+    boundaries = boundaries or {}
+    sections = "\n\n".join(
+        build_batch_section(name, formulas, boundaries.get(name, ()), budget, report)
+        for name, formulas in named_ranges.items()
+    )
+    return (
+        "You are an expert actuary and spreadsheet analyst.\n\n"
+        "Given the following remapped formulas from several Excel named ranges, summarize the pattern behind the calculations of each range in a general form.\n"
+        "Each formula follows a remapped structure using notation like [1][2] to indicate row and column indices.\n\n"
+        "Please return a JSON array with exactly one object per named range, each like:\n"
+        f"{_summary_object('<named range>')}\n\n"
+        "Copy each named range's name exactly into its \"named_range\" field.\n\n"
+        f"{sections}\n\n"
+        "Only return the JSON array."
+    )
+
+
 def build_purpose_prompt(summaries, example=None):
     joined_descriptions = "\n".join(
         f"{k}: {v.get('summary', '')}" for k, v in summaries.items() if "summary" in v
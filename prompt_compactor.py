@@ -0,0 +1,88 @@
+# prompt_compactor.py
+import os
+import threading
+
+# Tokens of formula text allowed in one named range's part of a prompt
+PROMPT_FORMULA_TOKENS = int(os.getenv("PROMPT_FORMULA_TOKENS", 1500))
+
+# tiktoken's encoding is loaded on first use, not at import: the first load downloads the BPE
+# file, and offline (stub or replay backends, no network) that must not stop the app loading.
+# If it cannot be loaded, tokens are estimated as a quarter of the characters.
+_encoding = None
+_encoding_tried = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_tried
+    if not _encoding_tried:
+        with _encoding_lock:
+            if not _encoding_tried:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("o200k_base")
+                except Exception:
+                    _encoding = None
+                _encoding_tried = True
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) < max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "…"
+
+
+def compact_formulas(formulas, boundary=(), budget=PROMPT_FORMULA_TOKENS):
+    # formulas: one remapped formula per distinct relative pattern; boundary: corner cells.
+    # Patterns go first, then boundary cells, one per line until the budget is spent;
+    # no single line may take more than a quarter of it. Returns (text, (tokens of every
+    # pattern and boundary cell in full, tokens after compaction)).
+    lines = []
+    seen = set()
+    for text in formulas:
+        if text not in seen:
+            seen.add(text)
+            lines.append(text)
+    for text in boundary:
+        # A corner that is itself a listed pattern's anchor adds nothing new
+        if text.partition(" = ")[2] not in seen and text not in seen:
+            seen.add(text)
+            lines.append(text)
+
+    sample = []
+    used = 0
+    per_line = max(budget // 4, 1)
+    for line in lines:
+        line = truncate_to_tokens(line, per_line)
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            break
+        sample.append(line)
+        used += cost
+    if len(sample) < len(lines):
+        sample.append(f"... {len(lines) - len(sample)} more omitted")
+
+    text = "\n".join(sample)
+    return text, (count_tokens("\n".join(lines)), count_tokens(text))
+
+
+def tokens_saved(report):
+    # report: {named range: (full tokens, compacted tokens)}, as collected by the prompt builders
+    before = sum(b for b, _ in report.values())
+    after = sum(a for _, a in report.values())
+    return before, after
@@ -0,0 +1,111 @@
+# response_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from disk_cache import CACHE_DIR
+
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "responses.sqlite"))
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 20000))
+MAX_AGE_DAYS = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", 30))
+
+response_cache_stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+
+def response_key(model, temperature, system_msg, user_prompt):
+    payload = json.dumps([model, temperature, system_msg, user_prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _connect():
+    # One short-lived connection per call, so worker threads never share one
+    os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(CACHE_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL)"
+    )
+    return conn
+
+
+def load(key):
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                row = conn.execute(
+                    "SELECT response FROM responses WHERE key = ? AND created >= ?",
+                    (key, time.time() - MAX_AGE_DAYS * 86400)
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        row = None
+    if row is None:
+        response_cache_stats["misses"] += 1
+        return None
+    response_cache_stats["hits"] += 1
+    return row[0]
+
+
+def store(key, response):
+    now = time.time()
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created, used) VALUES (?, ?, ?, ?)",
+                    (key, response, now, now)
+                )
+            response_cache_stats["writes"] += 1
+            if response_cache_stats["writes"] % 100 == 1:
+                _evict(conn)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def _evict(conn, max_entries=None, max_age_days=None):
+    max_entries = MAX_ENTRIES if max_entries is None else max_entries
+    max_age_days = MAX_AGE_DAYS if max_age_days is None else max_age_days
+    with conn:
+        removed = conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - max_age_days * 86400,)).rowcount
+        # Least recently used entries go first once the table is over its size limit
+        removed += conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY used DESC LIMIT -1 OFFSET ?)",
+            (max_entries,)
+        ).rowcount
+    response_cache_stats["evictions"] += removed
+
+
+def evict(max_entries=None, max_age_days=None):
+    try:
+        conn = _connect()
+        try:
+            _evict(conn, max_entries, max_age_days)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def clear():
+    evict(max_entries=0)
+
+
+def entry_count():
+    try:
+        conn = _connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return 0
@@ -0,0 +1,50 @@
+# sheet_flow.py
+from collections import Counter
+from io import BytesIO
+from openpyxl import load_workbook
+import disk_cache
+from lru import LRUCache
+from formula_tokenizer import iter_refs
+from workbook_cache import file_bytes_of, upload_hash
+
+MAX_FLOWS = 16
+
+_flows = LRUCache(MAX_FLOWS)
+
+
+def extract_sheet_flow(file_bytes):
+    # {(sheet, referenced_sheet): reference count} from one read-only pass over all formulas.
+    # Sheet names are matched case-insensitively and quoted names ('Base Rates'!A1) count too.
+    wb = load_workbook(BytesIO(file_bytes), read_only=True)
+    try:
+        sheets = {name.casefold(): name for name in wb.sheetnames}
+        edges = Counter()
+        for ws in wb.worksheets:
+            for row in ws.iter_rows(values_only=True):
+                for value in row:
+                    if not (isinstance(value, str) and value.startswith("=")):
+                        continue
+                    for token in iter_refs(value):
+                        if token.sheet is None or token.book:
+                            continue
+                        referenced = sheets.get(token.sheet.casefold())
+                        if referenced is not None and referenced != ws.title:
+                            edges[(ws.title, referenced)] += 1
+    finally:
+        wb.close()
+    return edges
+
+
+def get_sheet_flow(uploaded_file):
+    # Cached per file content, so widget changes and reruns don't rescan the workbook
+    key = upload_hash(uploaded_file)
+    edges = _flows.get(key)
+    if edges is not None:
+        return edges
+
+    disk_key = disk_cache.cache_key("flow", key)
+    edges = disk_cache.load("flow", disk_key)
+    if edges is None:
+        edges = extract_sheet_flow(file_bytes_of(uploaded_file))
+        disk_cache.store("flow", disk_key, edges)
+    return _flows.put(key, edges)
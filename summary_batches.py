@@ -0,0 +1,55 @@
+# summary_batches.py
+import json
+import os
+import re
+
+# Prompt tokens a packed request may use, and how many ranges one request may carry
+BATCH_TOKEN_BUDGET = int(os.getenv("SUMMARY_BATCH_TOKENS", 3000))
+MAX_BATCH_RANGES = int(os.getenv("SUMMARY_BATCH_RANGES", 20))
+
+
+def pack_batches(sizes, budget=BATCH_TOKEN_BUDGET, max_items=MAX_BATCH_RANGES):
+    # sizes: {key: tokens}. First-fit in the given order: each key joins the first batch that
+    # still has room for it. Anything over budget on its own gets a batch by itself and is
+    # sent as a normal single request.
+    batches = []
+    used = []
+    for key, size in sizes.items():
+        for i, batch in enumerate(batches):
+            if used[i] + size <= budget and len(batch) < max_items:
+                batch.append(key)
+                used[i] += size
+                break
+        else:
+            batches.append([key])
+            used.append(size)
+    return batches
+
+
+def strip_fences(response):
+    response = response.strip()
+    if response.startswith("```"):
+        response = re.sub(r"^```(json)?", "", response)
+        response = re.sub(r"```$", "", response)
+        response = response.strip()
+    return response
+
+
+def split_batch_response(response, names):
+    # {name: JSON text of that range's object} for every object the model returned intact;
+    # names it dropped, renamed or mangled are simply missing, for the caller to retry
+    try:
+        parsed = json.loads(strip_fences(response))
+    except (ValueError, AttributeError):
+        return {}
+    if isinstance(parsed, dict):
+        parsed = [parsed]
+    if not isinstance(parsed, list):
+        return {}
+
+    wanted = set(names)
+    found = {}
+    for item in parsed:
+        if isinstance(item, dict) and item.get("named_range") in wanted and item["named_range"] not in found:
+            found[item["named_range"]] = json.dumps(item)
+    return found
@@ -0,0 +1,47 @@
+# tests/test_file_handlers.py
+from io import BytesIO
+
+from openpyxl import Workbook
+from openpyxl.workbook.defined_name import DefinedName
+
+import disk_cache
+import file_handlers
+from benchmarks import BenchUpload
+from file_handlers import handle_uploaded_files
+from formula_mapper import remap_named_ranges
+
+
+def workbook_with_names(prefix):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Calc"
+    ws["A1"], ws["A2"] = 1, "=A1*2"
+    wb.defined_names[f"{prefix}_in"] = DefinedName(f"{prefix}_in", attr_text="Calc!$A$1")
+    wb.defined_names[f"{prefix}_out"] = DefinedName(f"{prefix}_out", attr_text="Calc!$A$2")
+    out = BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def test_remap_cache_ignores_runs_with_failed_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(disk_cache, "CACHE_DIR", str(tmp_path))
+    uploads = [BenchUpload(workbook_with_names("a"), "a.xlsx"), BenchUpload(workbook_with_names("b"), "b.xlsx")]
+
+    parse = file_handlers.parse_file_bytes
+    failures = {"b.xlsx"}
+
+    def flaky(file_bytes, display_name, mode):
+        if display_name in failures:
+            failures.discard(display_name)
+            raise MemoryError("out of memory")
+        return parse(file_bytes, display_name, mode)
+
+    monkeypatch.setattr(file_handlers, "parse_file_bytes", flaky)
+    first = handle_uploaded_files(uploads, workers=1)
+    assert list(first["file_errors"]) == ["b.xlsx"]
+    remap_named_ranges(first, {})
+
+    second = handle_uploaded_files(uploads, workers=1)
+    assert not second["file_errors"]
+    results = remap_named_ranges(second, {})
+    assert set(results) == {"a_in", "a_out", "b_in", "b_out"}
@@ -0,0 +1,36 @@
+# tests/test_formula_classes.py
+from formula_classes import classify_formulas, merge_rects, swept_areas
+from formula_mapper import find_dependencies, remap_named_range
+from named_coverage import class_references
+from named_index import NamedRangeIndex
+
+
+def test_copies_share_a_class():
+    classes = classify_formulas([(5, 1, "=A1*2"), (5, 2, "7"), (5, 3, "=C1*2")])
+    assert [(c.formula, c.rects) for c in classes] == [("=A1*2", [(5, 1, 5, 1), (5, 3, 5, 3)]), ("7", [(5, 2, 5, 2)])]
+
+
+def test_sweep_skips_cells_between_rectangles():
+    assert swept_areas("A1", (5, 1), [(5, 1, 5, 1), (5, 3, 5, 3)]) == [(1, 1, 1, 1), (1, 3, 1, 3)]
+    # Adjacent copies still sweep one merged area
+    assert swept_areas("A1", (5, 1), [(5, 1, 5, 2), (6, 1, 7, 2)]) == [(1, 1, 3, 2)]
+    assert swept_areas("$A$1", (5, 1), [(5, 1, 5, 1), (5, 3, 5, 3)]) == [(1, 1, 1, 1)]
+
+
+def test_merge_rects_unions_overlaps():
+    assert merge_rects([(1, 1, 2, 2), (2, 2, 3, 3)]) == [(1, 1, 1, 2), (2, 1, 2, 3), (3, 2, 3, 3)]
+    assert merge_rects([]) == []
+
+
+def test_class_dependencies_are_not_widened_over_gaps():
+    named_index = NamedRangeIndex()
+    for column, name in enumerate(("a1", "b1", "c1"), start=1):
+        named_index.add("f.xlsx", "S", name, 1, column, 1, column)
+    named_index.add("f.xlsx", "S", "res", 5, 1, 5, 3)
+    info = ("f.xlsx", "S", 5, 1, 5, 3)
+    result = remap_named_range("res", info, [[(5, 1, "=A1*2"), (5, 2, 7), (5, 3, "=C1*2")]], named_index, {})
+
+    dependencies = find_dependencies({"res": result["swept"], "a1": [], "b1": [], "c1": []})
+    assert dependencies["res"] == {"a1", "c1"}
+    references = [ref for c in result["classes"] for ref in class_references(c, "f.xlsx", "S")]
+    assert [rect for _, _, rect in references] == [(1, 1, 1, 1), (1, 3, 1, 3)]
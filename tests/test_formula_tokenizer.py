@@ -0,0 +1,85 @@
+# tests/test_formula_tokenizer.py
+import pytest
+from openpyxl.utils import get_column_letter
+
+from formula_tokenizer import MAX_COL, MAX_ROW, area_bounds, iter_refs, rewrite_areas, rewrite_refs, tokenize
+
+
+def kinds(formula):
+    return [(t.kind, t.text) for t in tokenize(formula) if t.kind not in ("SPACE", "OP")]
+
+
+def refs(formula):
+    return [(t.book, t.sheet, t.area) for t in iter_refs(formula)]
+
+
+def test_tokens_concatenate_back_to_formula():
+    formula = "=IF('Bob''s Sheet'!$A$1>0,SUM(Table1[Amount]),\"A1\")&#N/A"
+    assert "".join(t.text for t in tokenize(formula)) == formula
+
+
+def test_quoted_sheet_with_apostrophe():
+    assert refs("='Bob''s Sheet'!$A$1+1") == [(None, "Bob's Sheet", "$A$1")]
+
+
+def test_external_books():
+    assert refs("=[1]Inputs!B2*'[2]My Book'!C3") == [("[1]", "Inputs", "B2"), ("[2]", "My Book", "C3")]
+
+
+def test_absolute_and_mixed_refs():
+    assert refs("=SUM($B$2:C$10)+$D4") == [(None, None, "$B$2:C$10"), (None, None, "$D4")]
+
+
+def test_whole_column_and_row_ranges():
+    assert refs("=SUM(A:A)+SUM(3:5)+SUM($B:$D)") == [(None, None, "A:A"), (None, None, "3:5"), (None, None, "$B:$D")]
+
+
+def test_string_literals_hide_refs():
+    formula = '="A1 and ""B2"""&C3'
+    assert kinds(formula)[0] == ("STRING", '"A1 and ""B2"""')
+    assert refs(formula) == [(None, None, "C3")]
+    assert rewrite_areas(formula, lambda area: "X") == '="A1 and ""B2"""&X'
+
+
+def test_functions_are_not_refs():
+    assert kinds("=LOG10(A1)") == [("FUNCTION", "LOG10"), ("REF", "A1")]
+
+
+def test_structured_refs():
+    formula = "=SUM(Table1[Amount])+Table1[[#Totals],[Qty]]"
+    assert ("STRUCTURED", "Table1[Amount]") in kinds(formula)
+    assert ("STRUCTURED", "Table1[[#Totals],[Qty]]") in kinds(formula)
+    assert refs(formula) == []
+
+
+def test_errors():
+    assert [text for kind, text in kinds("=IF(ISERROR(A1),#N/A,#DIV/0!)") if kind == "ERROR"] == ["#N/A", "#DIV/0!"]
+    assert refs("=#REF!+A1") == [(None, None, "A1")]
+
+
+def test_rewrite_refs_keeps_text_between_refs():
+    formula = "=Calc!A1 + 'My Sheet'!B2:C3 * 2"
+    assert rewrite_refs(formula, lambda token: f"<{token.sheet}>") == "=<Calc> + <My Sheet> * 2"
+
+
+@pytest.mark.parametrize("bounds", [
+    (1, 1, 1, 1),
+    (2, 3, 10, 5),
+    (7, 26, 7, 27),
+    (1, 1, MAX_ROW, MAX_COL),
+    (100, 702, 200, 703),
+])
+def test_area_bounds_round_trips(bounds):
+    min_row, min_col, max_row, max_col = bounds
+    start = f"{get_column_letter(min_col)}{min_row}"
+    end = f"{get_column_letter(max_col)}{max_row}"
+    assert area_bounds(f"{start}:{end}") == bounds
+    assert area_bounds(f"${start.rstrip('0123456789')}${min_row}:{end}") == bounds
+    # Corners given in the other order describe the same rectangle
+    assert area_bounds(f"{end}:{start}") == bounds
+
+
+def test_area_bounds_whole_rows_and_columns():
+    assert area_bounds("$B:$D") == (1, 2, MAX_ROW, 4)
+    assert area_bounds("3:5") == (3, 1, 5, MAX_COL)
+    assert area_bounds("C7") == (7, 3, 7, 3)
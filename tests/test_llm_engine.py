@@ -0,0 +1,77 @@
+# tests/test_llm_engine.py
+import time
+
+import pytest
+
+import llm_engine
+from llm_backends import StubBackend
+from llm_engine import CircuitBreaker, LLMError, call_chat_model, call_chat_models
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    # Installs a stub backend, a fresh circuit breaker and no retries for one test
+    monkeypatch.setattr(llm_engine, "circuit_breaker", CircuitBreaker(failures=2, cooldown=0.05))
+    monkeypatch.setitem(llm_engine.retry_settings, "max_retries", 0)
+
+    def install(**settings):
+        stub = StubBackend(latency=0.0, **settings)
+        monkeypatch.setattr(llm_engine, "backend", stub)
+        return stub
+
+    return install
+
+
+def test_call_chat_model_raises_on_failure(backend):
+    backend(error_rate=1.0, error_status=400)
+    with pytest.raises(LLMError) as info:
+        call_chat_model("", "hello")
+    assert info.value.kind == "client"
+
+
+def test_call_chat_models_returns_errors_in_place(backend):
+    stub = backend(responder=lambda model, messages: messages[-1]["content"].upper())
+    results = call_chat_models([{"system_msg": "", "user_prompt": "a"}, {"system_msg": "", "user_prompt": "b"}])
+    assert results == ["A", "B"]
+    stub.error_rate, stub.error_status = 1.0, 400
+    results = call_chat_models([{"system_msg": "", "user_prompt": "c"}])
+    assert isinstance(results[0], LLMError)
+
+
+def test_timeout_is_per_call(backend):
+    stub = backend()
+    stub.latency = 0.2
+    with pytest.raises(LLMError) as info:
+        call_chat_model("", "slow", timeout=0.01)
+    assert info.value.kind == "timeout"
+    assert call_chat_model("", "slow", timeout=5).startswith("Stub response")
+
+
+def test_client_error_does_not_close_a_half_open_circuit(backend):
+    stub = backend(error_rate=1.0, error_status=503)
+    breaker = llm_engine.circuit_breaker
+    for prompt in ("a", "b"):
+        with pytest.raises(LLMError):
+            call_chat_model("", prompt)
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    stub.error_status = 400
+    with pytest.raises(LLMError) as info:
+        call_chat_model("", "c")
+    assert info.value.kind == "client"
+    # Still not closed, but the probe is released so the next call can try again
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+
+
+def test_configure_backend_builds_a_new_backend(monkeypatch):
+    monkeypatch.delenv("LLM_BACKEND", raising=False)
+    monkeypatch.setattr(llm_engine, "_configured_key", None)
+    original = llm_engine.get_backend()
+    monkeypatch.setattr(llm_engine, "backend", original)
+    configured = llm_engine.configure_backend("sk-test")
+    assert configured is not original and configured.api_key == "sk-test"
+    assert getattr(original, "api_key", None) != "sk-test"
+    assert llm_engine.configure_backend("sk-test") is configured
+    assert llm_engine.configure_backend("sk-other") is not configured
@@ -0,0 +1,29 @@
+# tests/test_named_coverage.py
+import random
+
+from formula_classes import merge_rects
+from named_coverage import _names_per_region
+
+
+def overlaps(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def test_names_per_region_lists_overlapping_names():
+    leftovers = [((1, 1, 2, 2), "x"), ((2, 2, 3, 3), "y"), ((10, 1, 10, 1), "z")]
+    regions = merge_rects([rect for rect, _ in leftovers])
+    names = _names_per_region(regions, leftovers)
+    assert dict(zip(regions, names)) == {
+        (1, 1, 1, 2): ["x"], (2, 1, 2, 3): ["x", "y"], (3, 2, 3, 3): ["y"], (10, 1, 10, 1): ["z"]
+    }
+
+
+def test_names_per_region_matches_a_full_scan():
+    rng = random.Random(7)
+    leftovers = []
+    for n in range(300):
+        top, left = rng.randint(1, 200), rng.randint(1, 30)
+        leftovers.append(((top, left, top + rng.randint(0, 20), left + rng.randint(0, 5)), f"n{n % 40}"))
+    regions = merge_rects([rect for rect, _ in leftovers])
+    expected = [sorted({by for rect, by in leftovers if overlaps(rect, region)}) for region in regions]
+    assert _names_per_region(regions, leftovers) == expected
@@ -0,0 +1,40 @@
+# tests/test_ooxml_extractor.py
+from datetime import date, datetime, time, timedelta
+from io import BytesIO
+
+import pytest
+from openpyxl import Workbook
+from openpyxl.utils.datetime import CALENDAR_MAC_1904
+from openpyxl.workbook.defined_name import DefinedName
+
+from file_handlers import INGESTION_MODES, parse_file_bytes
+
+
+def dated_workbook(iso_dates=False, epoch=None):
+    wb = Workbook()
+    wb.iso_dates = iso_dates
+    if epoch is not None:
+        wb.epoch = epoch
+    ws = wb.active
+    ws.title = "Dates"
+    ws["A1"], ws["B1"], ws["C1"], ws["D1"] = datetime(2020, 1, 2), timedelta(hours=30), date(2021, 5, 6), time(13, 30)
+    ws["E1"] = 43832
+    ws["F1"] = 0.25
+    ws["F1"].number_format = "0.00%"
+    ws["G1"] = 44000
+    ws["G1"].number_format = "dd/mm/yyyy hh:mm"
+    wb.defined_names["dates"] = DefinedName("dates", attr_text="Dates!$A$1:$G$1")
+    out = BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("iso_dates, epoch", [(False, None), (True, None), (False, CALENDAR_MAC_1904)])
+def test_native_dates_match_openpyxl(iso_dates, epoch):
+    data = dated_workbook(iso_dates, epoch)
+    cells = {mode: parse_file_bytes(data, "dates.xlsx", mode)["named_ref_cells"]["dates"] for mode in INGESTION_MODES}
+    assert cells["native"] == cells["full"] == cells["streaming"]
+    values = [value for _, _, value in cells["native"][0]]
+    assert values[0] == datetime(2020, 1, 2)
+    assert values[1] == timedelta(hours=30)
+    assert values[4:6] == [43832, 0.25]
@@ -0,0 +1,104 @@
+# tests/test_pipeline_scheduler.py
+import threading
+import time
+
+import pytest
+
+from pipeline_scheduler import StageScheduler
+
+
+def echo(row, results, emit):
+    return row
+
+
+def test_rows_come_back_in_row_order():
+    # Later rows finish first
+    delays = {0: 0.05, 1: 0.0, 2: 0.02}
+
+    def slow(row, results, emit):
+        time.sleep(delays[row])
+        return row * 10
+
+    scheduler = StageScheduler(concurrency=3)
+    scheduler.add("A", [0, 1, 2], slow)
+    assert scheduler.run() == {"A": [0, 10, 20]}
+
+
+def test_stage_runs_after_its_dependencies():
+    order = []
+
+    def record(name):
+        def run(row, results, emit):
+            order.append(name)
+            return row
+        return run
+
+    scheduler = StageScheduler(concurrency=4)
+    scheduler.add("A", [1, 2], record("A"))
+    scheduler.add("B", lambda results: [sum(results["A"])], record("B"), after=("A",))
+    scheduler.add("C", [None], lambda row, results, emit: results["B"][0] + 1, after=("B",))
+    results = scheduler.run()
+    assert results == {"A": [1, 2], "B": [3], "C": [4]}
+    assert order[-1] == "B" and order.count("A") == 2
+
+
+def test_unknown_dependency_raises():
+    scheduler = StageScheduler()
+    with pytest.raises(ValueError):
+        scheduler.add("B", [1], echo, after=("A",))
+
+
+def test_cycles_cannot_be_added():
+    scheduler = StageScheduler()
+    with pytest.raises(ValueError):
+        scheduler.add("A", [1], echo, after=("A",))
+    scheduler.add("A", [1], echo)
+    scheduler.add("B", [1], echo, after=("A",))
+    # Re-adding A behind B would close the loop
+    with pytest.raises(ValueError):
+        scheduler.add("A", [1], echo, after=("B",))
+
+
+def test_failed_row_is_recorded_and_others_finish():
+    def flaky(row, results, emit):
+        if row == 1:
+            raise RuntimeError("boom")
+        return row
+
+    events = []
+    scheduler = StageScheduler(concurrency=2)
+    scheduler.add("A", [0, 1, 2], flaky)
+    scheduler.add("B", [5], echo)
+    scheduler.add("C", lambda results: results["A"], echo, after=("A",))
+    results = scheduler.run(lambda kind, stage, index, value: events.append((kind, stage, index)))
+    assert results["A"][0] == 0 and results["A"][2] == 2
+    assert isinstance(results["A"][1], RuntimeError)
+    assert results["B"] == [5]
+    assert len(results["C"]) == 3
+    assert ("row", "A", 1) in events
+
+
+def test_empty_stage_finishes_and_releases_dependents():
+    scheduler = StageScheduler()
+    scheduler.add("A", [], echo)
+    scheduler.add("B", lambda results: [len(results["A"])], echo, after=("A",))
+    assert scheduler.run() == {"A": [], "B": [0]}
+    assert [row["Stage"] for row in scheduler.timing_report()] == ["A", "B"]
+
+
+def test_pieces_reach_on_event_on_the_calling_thread():
+    caller = threading.get_ident()
+    seen = []
+
+    def stream(row, results, emit):
+        for piece in ("a", "b"):
+            emit(piece)
+        return "ab"
+
+    def on_event(kind, stage, index, value):
+        seen.append((kind, value, threading.get_ident() == caller))
+
+    scheduler = StageScheduler()
+    scheduler.add("A", [None], stream)
+    scheduler.run(on_event)
+    assert seen == [("piece", "a", True), ("piece", "b", True), ("row", "ab", True), ("stage", ["ab"], True)]
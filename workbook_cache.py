@@ -0,0 +1,58 @@
+# workbook_cache.py
+import hashlib
+import os
+import weakref
+from io import BytesIO
+from openpyxl import load_workbook
+from lru import LRUCache
+
+# Parsed workbooks are kept per process so Streamlit reruns reuse them too. A full
+# openpyxl model of a large workbook runs to hundreds of MB, so only a few are kept.
+MAX_WORKBOOKS = int(os.getenv("WORKBOOK_CACHE_SIZE", 2))
+
+_workbooks = LRUCache(MAX_WORKBOOKS)
+_upload_hashes = weakref.WeakKeyDictionary()
+cache_stats = {"hits": 0, "misses": 0}
+
+
+def file_bytes_of(uploaded_file):
+    if hasattr(uploaded_file, "getvalue"):
+        return uploaded_file.getvalue()
+    uploaded_file.seek(0)
+    return uploaded_file.read()
+
+
+def content_hash(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+def upload_hash(uploaded_file):
+    # Hashing a 20 MB upload is not free, so remember it per upload object
+    try:
+        return _upload_hashes[uploaded_file]
+    except (KeyError, TypeError):
+        pass
+    digest = content_hash(file_bytes_of(uploaded_file))
+    try:
+        _upload_hashes[uploaded_file] = digest
+    except TypeError:
+        pass
+    return digest
+
+
+def get_workbook(uploaded_file, data_only=False):
+    key = (upload_hash(uploaded_file), data_only)
+
+    wb = _workbooks.get(key)
+    if wb is not None:
+        cache_stats["hits"] += 1
+        return wb
+
+    cache_stats["misses"] += 1
+    return _workbooks.put(key, load_workbook(BytesIO(file_bytes_of(uploaded_file)), data_only=data_only))
+
+
+def clear_workbook_cache():
+    _workbooks.clear()
+    cache_stats["hits"] = 0
+    cache_stats["misses"] = 0